@@ -0,0 +1,240 @@
+# analytics.py
+# sales rollups for the admin reports: revenue per day, sales per product,
+# orders per status and per-customer totals. checkout and status changes
+# update them in the same transaction as the order, so a report reads a few
+# rows by primary key or off an index instead of scanning every order.
+#
+# checkout and the rebuild run the same grouped statements: checkout over
+# the one order it placed, the rebuild over all of them.
+#
+#   flask analytics rebuild     # recompute every rollup from the orders
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import text
+from sqlalchemy.dialects.sqlite import insert
+
+from db_create import db, Customer, Item, Order, DailySales, ProductSales, StatusSales, CustomerSales
+from orders import STATUSES
+
+MAX_DAYS = 366
+MAX_LIMIT = 100
+
+# one row per order with its unit count; {where} filters on "order" o
+ORDERS = """
+SELECT o.id, o.customer_id, o.status, o.total_amount, o.date_created,
+       date(o.date_created) AS day,
+       (SELECT coalesce(sum(quantity), 0) FROM order_item WHERE order_id = o.id) AS units
+FROM "order" o
+WHERE {where}
+"""
+
+# "WHERE true" keeps sqlite from reading ON CONFLICT as a join constraint
+ROLLUPS = [
+    """
+INSERT INTO daily_sales (day, orders, units, revenue)
+SELECT day, count(*), sum(units), sum(total_amount)
+FROM (""" + ORDERS + """) WHERE true
+GROUP BY day
+ON CONFLICT (day) DO UPDATE SET
+    orders = orders + excluded.orders,
+    units = units + excluded.units,
+    revenue = revenue + excluded.revenue
+""",
+    """
+INSERT INTO product_sales (item_id, orders, units, revenue, last_sold_at)
+SELECT oi.product_id, count(DISTINCT oi.order_id), sum(oi.quantity),
+       sum(oi.quantity * oi.price), max(o.date_created)
+FROM order_item oi JOIN "order" o ON o.id = oi.order_id
+WHERE {where}
+GROUP BY oi.product_id
+ON CONFLICT (item_id) DO UPDATE SET
+    orders = orders + excluded.orders,
+    units = units + excluded.units,
+    revenue = revenue + excluded.revenue,
+    last_sold_at = excluded.last_sold_at
+""",
+    """
+INSERT INTO status_sales (status, orders, revenue)
+SELECT status, count(*), sum(total_amount)
+FROM "order" o
+WHERE {where} AND status IS NOT NULL
+GROUP BY status
+ON CONFLICT (status) DO UPDATE SET
+    orders = orders + excluded.orders,
+    revenue = revenue + excluded.revenue
+""",
+    """
+INSERT INTO customer_sales (customer_id, orders, units, revenue, first_order_at, last_order_at)
+SELECT customer_id, count(*), sum(units), sum(total_amount), min(date_created), max(date_created)
+FROM (""" + ORDERS + """) WHERE customer_id IS NOT NULL
+GROUP BY customer_id
+ON CONFLICT (customer_id) DO UPDATE SET
+    orders = orders + excluded.orders,
+    units = units + excluded.units,
+    revenue = revenue + excluded.revenue,
+    first_order_at = coalesce(first_order_at, excluded.first_order_at),
+    last_order_at = excluded.last_order_at
+""",
+]
+
+ONE_ORDER = [text(sql.format(where='o.id = :oid')) for sql in ROLLUPS]
+ALL_ORDERS = [text(sql.format(where='true')) for sql in ROLLUPS]
+
+SET_STATUS = text('UPDATE "order" SET status = :new WHERE id = :id AND status IS :old')
+
+
+# ---------------- WRITES ----------------
+def record_order(order_id):
+    # a new order: add it to every rollup (caller commits, after the order
+    # lines are in)
+    for stmt in ONE_ORDER:
+        db.session.execute(stmt, {'oid': order_id})
+
+
+def _add_status(status, orders, revenue):
+    stmt = insert(StatusSales).values(status=status, orders=orders, revenue=revenue)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['status'],
+        set_={
+            'orders': StatusSales.orders + orders,
+            'revenue': StatusSales.revenue + revenue,
+        }
+    )
+    db.session.execute(stmt)
+
+
+def change_status(order, status):
+    # compare-and-set on the status the row has now, so two admins moving the
+    # same order each move its count from where it really was. caller commits.
+    # returns False if the order already had that status; ValueError for a
+    # status that is not one of STATUSES
+    if status not in STATUSES:
+        raise ValueError('unknown order status %r' % (status,))
+    while True:
+        row = db.session.query(Order.status).filter(Order.id == order.id).first()
+        if row is None or row.status == status:
+            return False
+        old = row.status
+        if db.session.execute(SET_STATUS, {'id': order.id, 'old': old, 'new': status}).rowcount:
+            break
+    if old is not None:
+        _add_status(old, -1, -order.total_amount)
+    _add_status(status, 1, order.total_amount)
+    db.session.expire(order, ['status'])
+    return True
+
+
+def rebuild():
+    # recompute everything from the orders, one grouped statement per rollup.
+    # the deletes take the write lock first, so no checkout lands in between
+    for model in (DailySales, ProductSales, StatusSales, CustomerSales):
+        db.session.query(model).delete()
+    for stmt in ALL_ORDERS:
+        db.session.execute(stmt)
+    db.session.commit()
+
+
+def backfill():
+    # databases with orders placed before the rollups existed
+    if StatusSales.query.first() is None and Order.query.first() is not None:
+        rebuild()
+
+
+# ---------------- READS ----------------
+def summary():
+    # totals are the sum of the per-status rows: one row per status
+    by_status = {row.status: {'orders': row.orders, 'revenue': row.revenue}
+                 for row in StatusSales.query.all()}
+    orders = sum(row['orders'] for row in by_status.values())
+    revenue = sum(row['revenue'] for row in by_status.values())
+    today = DailySales.query.get(datetime.utcnow().date().isoformat())
+    return {
+        'orders': orders,
+        'revenue': revenue,
+        'average_order': round(revenue / orders, 2) if orders else None,
+        'by_status': by_status,
+        'today': {
+            'orders': today.orders if today else 0,
+            'units': today.units if today else 0,
+            'revenue': today.revenue if today else 0,
+        },
+    }
+
+
+def daily(days=30):
+    # the last `days` days, oldest first; days without orders are zeros
+    days = min(max(days, 1), MAX_DAYS)
+    first = datetime.utcnow().date() - timedelta(days=days - 1)
+    rows = {row.day: row for row in
+            DailySales.query.filter(DailySales.day >= first.isoformat())}
+    result = []
+    for n in range(days):
+        day = (first + timedelta(days=n)).isoformat()
+        row = rows.get(day)
+        result.append({
+            'day': day,
+            'orders': row.orders if row else 0,
+            'units': row.units if row else 0,
+            'revenue': row.revenue if row else 0,
+        })
+    return result
+
+
+def top_products(by='units', limit=10):
+    # walks ix_product_sales_units / _revenue backwards, `limit` rows
+    column = ProductSales.revenue if by == 'revenue' else ProductSales.units
+    rows = db.session.query(ProductSales, Item.name) \
+        .outerjoin(Item, Item.id == ProductSales.item_id) \
+        .order_by(column.desc(), ProductSales.item_id.desc()) \
+        .limit(min(max(limit, 1), MAX_LIMIT)).all()
+    return [{
+        'item_id': sales.item_id,
+        'name': name,
+        'orders': sales.orders,
+        'units': sales.units,
+        'revenue': sales.revenue,
+        'last_sold_at': sales.last_sold_at.isoformat() if sales.last_sold_at else None,
+    } for sales, name in rows]
+
+
+def customer_to_json(sales, username=None):
+    return {
+        'customer_id': sales.customer_id,
+        'username': username,
+        'orders': sales.orders,
+        'units': sales.units,
+        'lifetime_value': sales.revenue,
+        'average_order': round(sales.revenue / sales.orders, 2) if sales.orders else None,
+        'first_order_at': sales.first_order_at.isoformat() if sales.first_order_at else None,
+        'last_order_at': sales.last_order_at.isoformat() if sales.last_order_at else None,
+    }
+
+
+def top_customers(limit=10):
+    rows = db.session.query(CustomerSales, Customer.username) \
+        .outerjoin(Customer, Customer.id == CustomerSales.customer_id) \
+        .order_by(CustomerSales.revenue.desc(), CustomerSales.customer_id.desc()) \
+        .limit(min(max(limit, 1), MAX_LIMIT)).all()
+    return [customer_to_json(sales, username) for sales, username in rows]
+
+
+def customer_summary(customer_id):
+    # None if the customer has never ordered
+    row = db.session.query(CustomerSales, Customer.username) \
+        .outerjoin(Customer, Customer.id == CustomerSales.customer_id) \
+        .filter(CustomerSales.customer_id == customer_id).first()
+    return customer_to_json(*row) if row else None
+
+
+# ---------------- CLI ----------------
+analytics_cli = AppGroup('analytics', help='Sales rollups for the admin reports.')
+
+
+@analytics_cli.command('rebuild')
+def rebuild_command():
+    """Recompute every sales rollup from the order tables."""
+    rebuild()
+    totals = summary()
+    click.echo('rollups rebuilt: %d orders, revenue %d' % (totals['orders'], totals['revenue']))
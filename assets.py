@@ -0,0 +1,235 @@
+# assets.py
+# static asset pipeline. "flask assets build" copies everything in static/
+# to static/dist/ under content-hashed names, plus:
+#   - .gz / .br copies of css, js and svg (brotli only if the package is installed)
+#   - resized and WebP variants of jpg/png images (needs Pillow)
+#   - url(...) references in css rewritten to the fingerprinted names
+#   - manifest.json: logical name -> fingerprinted name
+# at runtime url_for('static', filename=...) is rewritten through the manifest
+# and the fingerprinted files are served with a one-year immutable
+# Cache-Control, picking the .br/.gz/.webp copy the browser accepts.
+# without a build (no manifest) nothing changes.
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import AppGroup, with_appcontext
+
+DIST = 'dist'
+WIDTHS = (480, 960)
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt'}
+RESIZABLE = {'.jpg', '.jpeg', '.png'}
+ONE_YEAR = 365 * 24 * 3600
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+class Manifest:
+    def __init__(self, data=None):
+        data = data or {}
+        self.files = data.get('files', {})           # "images/1.jpg" -> "dist/images/1.<hash>.jpg"
+        self.srcset = data.get('srcset', {})         # "images/1.jpg" -> [[480, "dist/..."], ...]
+        self.webp = data.get('webp', {})             # fingerprinted name -> its .webp twin
+        self.encodings = data.get('encodings', {})   # fingerprinted name -> ["br", "gzip"]
+
+    def to_json(self):
+        return {'files': self.files, 'srcset': self.srcset,
+                'webp': self.webp, 'encodings': self.encodings}
+
+
+manifest = Manifest()
+
+
+# ---------------- BUILD ----------------
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _compress(out, name, data):
+    encodings = []
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    if brotli is not None:
+        _write(os.path.join(out, name + '.br'), brotli.compress(data, quality=11))
+        encodings.append('br')
+    _write(os.path.join(out, name + '.gz'), gzip.compress(data, 9, mtime=0))
+    encodings.append('gzip')
+    return encodings
+
+
+def _image_variants(Image, out, source, stem, digest, ext, result, logical):
+    # "<stem>.<hash>.<width>w<ext>" for each width below the original, and a
+    # .webp twin next to every jpg/png copy (the original size included)
+    with Image.open(source) as img:
+        img.load()
+        width, height = img.size
+        fmt = 'JPEG' if ext in ('.jpg', '.jpeg') else 'PNG'
+        copies = [(None, '%s/%s.%s%s' % (DIST, stem, digest, ext), img)]
+        for w in WIDTHS:
+            if w < width:
+                resized = img.resize((w, max(1, round(height * w / width))), Image.LANCZOS)
+                name = '%s/%s.%s.%dw%s' % (DIST, stem, digest, w, ext)
+                resized.save(os.path.join(out, name), fmt, optimize=True,
+                             **({'quality': 85} if fmt == 'JPEG' else {}))
+                copies.append((w, name, resized))
+        for w, name, copy in copies:
+            webp_name = os.path.splitext(name)[0] + '.webp'
+            copy.save(os.path.join(out, webp_name), 'WEBP', quality=80)
+            result.webp[name] = webp_name
+        result.srcset[logical] = [[w, name] for w, name, copy in copies if w] + [[width, copies[0][1]]]
+
+
+def _rewrite_css(data, logical, name, files):
+    # url(images/a.jpg) -> url(images/a.<hash>.jpg), relative to where the
+    # fingerprinted stylesheet lives; external and data: urls are left alone
+    def replace(match):
+        quote, url = match.groups()
+        # suffix: ?query / #fragment, kept as it is
+        path, suffix = re.match(r'([^?#]*)(.*)', url.strip()).groups()
+        if ':' in path or path.startswith('/'):
+            return match.group(0)
+        target = files.get(posixpath.normpath(posixpath.join(posixpath.dirname(logical), path)))
+        if target is None:
+            return match.group(0)
+        return 'url(%s%s%s%s)' % (quote, posixpath.relpath(target, posixpath.dirname(name)), suffix, quote)
+    return CSS_URL.sub(replace, data.decode('utf-8')).encode('utf-8')
+
+
+def build_assets(static_folder):
+    # returns (manifest, {"files": n, "bytes_in": .., "bytes_gz": ..})
+    try:
+        from PIL import Image
+    except ImportError:
+        Image = None
+    dist = os.path.join(static_folder, DIST)
+    shutil.rmtree(dist, ignore_errors=True)
+    result = Manifest()
+    stats = {'files': 0, 'bytes_in': 0, 'bytes_compressed': 0, 'images_resized': 0}
+
+    sources = []
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != dist)
+        for filename in sorted(files):
+            source = os.path.join(root, filename)
+            sources.append((source, os.path.relpath(source, static_folder).replace(os.sep, '/')))
+    # stylesheets last: their url()s point at names fingerprinted before them
+    sources.sort(key=lambda s: s[1].lower().endswith('.css'))
+
+    for source, logical in sources:
+        with open(source, 'rb') as f:
+            data = f.read()
+        stem, ext = os.path.splitext(logical)
+        if ext.lower() == '.css':
+            data = _rewrite_css(data, logical, '%s/%s' % (DIST, logical), result.files)
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        name = '%s/%s.%s%s' % (DIST, stem, digest, ext)
+        _write(os.path.join(static_folder, name), data)
+        result.files[logical] = name
+        stats['files'] += 1
+        stats['bytes_in'] += len(data)
+
+        if ext.lower() in COMPRESSIBLE:
+            result.encodings[name] = _compress(static_folder, name, data)
+            stats['bytes_compressed'] += os.path.getsize(os.path.join(static_folder, name + '.gz'))
+        elif ext.lower() in RESIZABLE and Image is not None:
+            _image_variants(Image, static_folder, source, stem, digest, ext.lower(), result, logical)
+            stats['images_resized'] += 1
+
+    with open(os.path.join(dist, 'manifest.json'), 'w') as f:
+        json.dump(result.to_json(), f, indent=1, sort_keys=True)
+    return result, stats, Image is not None
+
+
+assets_cli = AppGroup('assets', help='Static asset pipeline.')
+
+
+@assets_cli.command('build')
+@with_appcontext
+def build_command():
+    """Fingerprint, compress and resize everything in static/ into static/dist/."""
+    result, stats, images = build_assets(current_app.static_folder)
+    click.echo('%d files (%.1f MB) -> static/%s, %d compressed to %.1f KB gzip'
+               % (stats['files'], stats['bytes_in'] / 1e6, DIST,
+                  len(result.encodings), stats['bytes_compressed'] / 1e3))
+    if images:
+        click.echo('%d images resized to %s px + WebP' % (stats['images_resized'], WIDTHS))
+    else:
+        click.echo('Pillow not installed: no resized / WebP image variants')
+    click.echo('restart the app to pick up the new manifest')
+
+
+# ---------------- RUNTIME ----------------
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return Manifest(json.load(f))
+    except (OSError, ValueError):
+        return Manifest()
+
+
+def fingerprint(endpoint, values):
+    # url_defaults hook: static/<name> -> static/dist/<name>.<hash>.<ext>
+    if endpoint == 'static' and values.get('filename') in manifest.files:
+        values['filename'] = manifest.files[values['filename']]
+
+
+def asset_srcset(filename):
+    # "url 480w, url 960w, url 1200w" for <img srcset>, '' without a build
+    return ', '.join('%s %dw' % (url_for('static', filename=name), w)
+                     for w, name in manifest.srcset.get(filename, []))
+
+
+def serve_static(filename):
+    # replaces flask's static view; send_from_directory's ETag answers
+    # If-None-Match with a 304
+    folder = current_app.static_folder
+    if not filename.startswith(DIST + '/'):
+        return send_from_directory(folder, filename, etag=True)
+
+    mimetype = mimetypes.guess_type(filename)[0]
+    headers = {}
+    served = filename
+
+    webp = manifest.webp.get(filename)
+    if webp and 'image/webp' in request.headers.get('Accept', ''):
+        served, mimetype = webp, 'image/webp'
+    if filename in manifest.webp:
+        headers['Vary'] = 'Accept'
+
+    encodings = manifest.encodings.get(filename, [])
+    for encoding in encodings:
+        if request.accept_encodings[encoding]:
+            served = filename + ('.br' if encoding == 'br' else '.gz')
+            headers['Content-Encoding'] = encoding
+            break
+    if encodings:
+        headers['Vary'] = 'Accept-Encoding'
+
+    response = send_from_directory(folder, served, mimetype=mimetype, etag=True, max_age=ONE_YEAR,
+                                   download_name=os.path.basename(filename))
+    response.headers.update(headers)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_assets(app):
+    # ASSETS_MANIFEST defaults to static/dist/manifest.json
+    path = app.config.setdefault(
+        'ASSETS_MANIFEST', os.path.join(app.static_folder, DIST, 'manifest.json'))
+    loaded = load_manifest(path)
+    manifest.__dict__.update(loaded.__dict__)
+    app.url_defaults(fingerprint)
+    app.add_template_global(asset_srcset)
+    app.view_functions['static'] = serve_static
+    app.cli.add_command(assets_cli)
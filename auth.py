@@ -0,0 +1,146 @@
+# auth.py
+# who is logged in, without a customer query on every request. flask-login's
+# user loader hands out a small Principal (id, username, email, date_joined)
+# instead of the Customer row, cached per user for AUTH_CACHE_TTL seconds.
+# any ORM update or delete of the customer drops it once the transaction
+# commits, so a changed profile or password is seen on the next request.
+#
+# the cache is per process: another worker can keep a stale principal for
+# up to AUTH_CACHE_TTL after a change, hence the short default. bulk SQL
+# writes to customer must call principals.invalidate(id) themselves.
+#
+# config (all optional):
+#   AUTH_CACHE_TTL    seconds a principal is reused; 0 queries every request (default 60)
+#   AUTH_CACHE_SIZE   principals kept per process (default 10000)
+#   ADMIN_EMAILS      customers allowed into the admin reports (default: nobody)
+import threading
+from functools import wraps
+
+from flask import abort, current_app
+from flask_login import current_user, login_required
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from cache import LocalCache, MISSING
+from db_create import db, Customer
+
+
+class Principal:
+    # the logged-in customer as request handlers see it: plain attributes,
+    # nothing bound to a session, nothing lazy-loaded
+    __slots__ = ('id', 'username', 'email', 'date_joined')
+
+    # REQUIRED BY FLASK-LOGIN
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, id, username, email, date_joined):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.date_joined = date_joined
+
+    def get_id(self):
+        return str(self.id)
+
+    def __repr__(self):
+        return '<Principal %d>' % self.id
+
+
+class PrincipalCache:
+    def __init__(self, ttl=60, maxsize=10000):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache = LocalCache(maxsize=maxsize, ttl=ttl)
+        # bumped by every invalidation: a load that raced with one is not cached
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def configure(self, ttl, maxsize):
+        self.ttl = ttl
+        self._cache = LocalCache(maxsize=maxsize, ttl=ttl)
+
+    def load(self, user_id):
+        # Principal, or None if the customer no longer exists
+        if self.ttl:
+            principal = self._cache.get(user_id)
+            if principal is not MISSING:
+                self.hits += 1
+                return principal
+        self.misses += 1
+        epoch = self._epoch
+        row = db.session.query(Customer.id, Customer.username, Customer.email, Customer.date_joined) \
+            .filter(Customer.id == user_id).first()
+        if row is None:
+            return None
+        principal = Principal(*row)
+        if self.ttl:
+            with self._lock:
+                if epoch == self._epoch:
+                    self._cache.set(user_id, principal)
+        return principal
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._epoch += 1
+            self._cache.delete(user_id)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._cache)}
+
+
+principals = PrincipalCache()
+
+
+# ---------------- INVALIDATION ----------------
+# ORM writes to Customer mark the session; principals are dropped only once
+# the transaction commits
+def _mark_customer(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('customers_dirty', set()).add(target.id)
+
+
+def _after_commit(session):
+    for user_id in session.info.pop('customers_dirty', ()):
+        principals.invalidate(user_id)
+
+
+def _after_rollback(session):
+    session.info.pop('customers_dirty', None)
+
+
+def watch_customers():
+    if event.contains(Customer, 'after_update', _mark_customer):
+        return
+    for name in ('after_update', 'after_delete'):
+        event.listen(Customer, name, _mark_customer)
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_rollback', _after_rollback)
+
+
+# ---------------- ADMIN ----------------
+def is_admin(user):
+    return user.is_authenticated and \
+        (user.email or '').lower() in {e.lower() for e in current_app.config['ADMIN_EMAILS']}
+
+
+def admin_required(view):
+    # logged in (else the login page) and listed in ADMIN_EMAILS (else 403)
+    @wraps(view)
+    @login_required
+    def wrapper(*args, **kwargs):
+        if not is_admin(current_user):
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def init_auth(app):
+    app.config.setdefault('AUTH_CACHE_TTL', 60)
+    app.config.setdefault('ADMIN_EMAILS', ())
+    app.config.setdefault('AUTH_CACHE_SIZE', 10000)
+    principals.configure(app.config['AUTH_CACHE_TTL'], app.config['AUTH_CACHE_SIZE'])
+    watch_customers()
@@ -0,0 +1,143 @@
+# bench_auth.py
+# login storm: many customers sign in at once (plus a few scripts guessing
+# passwords) while other shoppers browse the catalogue. reports catalogue
+# latency during the storm, what happened to the logins and how much
+# hashing was done, so inline hashing and the worker pool can be compared.
+#
+#   python bench_auth.py                        # hash on the request threads (default)
+#   python bench_auth.py --hash-workers 2       # hashing pool
+#   python bench_auth.py --logins 64 --guessers 8 --duration 10
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+PASSWORD = 'bench-password'
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * p / 100.0), len(sorted_values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='login storm vs catalogue latency')
+    parser.add_argument('--logins', type=int, default=32, help='threads logging in over and over')
+    parser.add_argument('--guessers', type=int, default=4, help='threads guessing one password each')
+    parser.add_argument('--browsers', type=int, default=8, help='threads browsing the catalogue')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds')
+    parser.add_argument('--hash-workers', type=int, help='AUTH_HASH_WORKERS (0: inline)')
+    parser.add_argument('--hash-queue', type=int, help='AUTH_HASH_QUEUE')
+    args = parser.parse_args()
+
+    from app import create_app, setup_database
+    from db_create import db, Customer
+    import passwords
+
+    path = os.path.join(tempfile.mkdtemp(prefix='shop-auth-'), 'auth.db')
+    config = {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+        'SECRET_KEY': 'bench',
+        'WTF_CSRF_ENABLED': False,
+        'MAIL_WORKERS': 0,
+        'METRICS_SLOW_MS': 10 ** 9,
+    }
+    if args.hash_workers is not None:
+        config['AUTH_HASH_WORKERS'] = args.hash_workers
+    if args.hash_queue:
+        config['AUTH_HASH_QUEUE'] = args.hash_queue
+    app = create_app(config)
+    customers = args.logins + args.browsers + args.guessers
+    with app.app_context():
+        setup_database()
+        password_hash = generate_password_hash(PASSWORD)
+        db.session.execute(insert(Customer.__table__), [
+            {'username': 'user%d' % n, 'email': 'user%d@bench.test' % n,
+             'password_hash': password_hash} for n in range(customers)
+        ])
+        db.session.commit()
+
+    stop = threading.Event()
+    lock = threading.Lock()
+    outcomes = Counter()
+    timings = []
+
+    def client(n):
+        # every thread is its own client address
+        c = app.test_client()
+        c.environ_base['REMOTE_ADDR'] = '10.0.%d.%d' % (n // 250, n % 250 + 1)
+        return c
+
+    def login(n, password):
+        response = client(n).post('/', data={'email': 'user%d@bench.test' % n, 'password': password})
+        if response.status_code == 302:
+            return 'ok'
+        return {429: 'rate limited', 503: 'hashing busy'}.get(response.status_code, 'refused')
+
+    def storm(n):
+        while not stop.is_set():
+            result = login(n, PASSWORD)
+            with lock:
+                outcomes['login ' + result] += 1
+
+    def guesser(n):
+        rnd = random.Random(n)
+        while not stop.is_set():
+            result = login(n, 'guess-%d' % rnd.randint(0, 10 ** 6))
+            with lock:
+                outcomes['guess ' + result] += 1
+
+    def browser(n):
+        c = client(n)
+        # logged in before the storm; retried while the warm-up logins queue
+        while c.post('/', data={'email': 'user%d@bench.test' % n, 'password': PASSWORD}).status_code != 302:
+            time.sleep(0.05)
+        while not stop.is_set():
+            started = time.perf_counter()
+            ok = c.get('/amazon/').status_code == 200
+            with lock:
+                timings.append(time.perf_counter() - started)
+                outcomes['browse ' + ('ok' if ok else 'error')] += 1
+
+    # the browsers log in and warm up first; then the storm starts
+    browsers = [threading.Thread(target=browser, args=(n,)) for n in range(args.browsers)]
+    for t in browsers:
+        t.start()
+    time.sleep(1.0)
+    with lock:
+        del timings[:]
+        outcomes.clear()
+    first = args.browsers
+    threads = [threading.Thread(target=storm, args=(first + n,)) for n in range(args.logins)]
+    first += args.logins
+    threads += [threading.Thread(target=guesser, args=(first + n,)) for n in range(args.guessers)]
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in browsers + threads:
+        t.join()
+
+    timings.sort()
+    stats = passwords.stats()
+    print('hashing: %s workers, queue %d' % (
+        stats['workers'] or 'inline (0)', app.config['AUTH_HASH_QUEUE']))
+    print('catalogue during the storm: %d requests, p50 %.1f ms, p95 %.1f ms, p99 %.1f ms' % (
+        len(timings), percentile(timings, 50) * 1000, percentile(timings, 95) * 1000,
+        percentile(timings, 99) * 1000))
+    for name, count in sorted(outcomes.items()):
+        print('  %-22s %6d' % (name, count))
+    print('hashes: %d (%.1f/s), %.1fs waited, %d turned away busy, %d rate limited' % (
+        stats['hashes'], stats['hashes'] / args.duration, stats['seconds'], stats['busy'],
+        stats['limited']))
+
+
+if __name__ == '__main__':
+    main()
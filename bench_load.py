@@ -0,0 +1,322 @@
+# bench_load.py
+# load test for the hot routes: seeds a synthetic shop into a scratch
+# database, runs concurrent simulated shoppers against it and reports
+# p50/p95/p99 latency, requests/s and SQL queries per request per route.
+#
+#   python bench_load.py                            # test client, 8 users, 20s
+#   python bench_load.py --mode server --users 32   # real threaded WSGI server
+#   python bench_load.py --items 100000 --reviews 500000 --json after.json
+#   python bench_load.py --compare before.json      # print the change per route
+#   python bench_load.py --gateway-latency-ms 800   # payments against a slow gateway
+#   python bench_load.py --auth-cache-ttl 0         # load the customer on every request
+#
+# the same --seed gives the same dataset and the same request sequence
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from werkzeug.security import generate_password_hash
+
+# route label -> (weight in the mix, flask endpoint for the query counts)
+ROUTES = {
+    'amazon': (10, 'shop.amazon'),
+    'search': (15, 'shop.search'),
+    'product_detail': (25, 'shop.product_detail'),
+    'cart': (10, 'shop.cart'),
+    'cart_add': (10, 'shop.cart_batch'),
+    'wishlist': (8, 'shop.wishlist_view'),
+    'wishlist_toggle': (5, 'shop.toggle_wishlist'),
+    'myorders': (5, 'shop.myorders'),
+    'success': (2, 'shop.success'),
+    'card_intent': (3, 'shop.create_card_intent'),
+}
+SEARCH_WORDS = ['smart', 'phone', 'shoe', 'watch', 'blue', 'pro', 'mini', 'home', 'sport', 'max']
+PASSWORD = 'bench-password'
+
+
+# ---------------- DATASET ----------------
+def seed(app, args):
+    from sqlalchemy import insert
+    from app import setup_database
+    from cache import catalog_cache
+    from db_create import db, Customer, Item, Review, Wishlist, CartItem, Order, OrderItem
+    import ratings
+
+    rnd = random.Random(args.seed)
+    now = datetime.utcnow()
+    # one hash for everybody: pbkdf2 per customer would dominate seeding
+    password_hash = generate_password_hash(PASSWORD)
+
+    def bulk(table, rows, size=5000):
+        for start in range(0, len(rows), size):
+            db.session.execute(insert(table), rows[start:start + size])
+
+    with app.app_context():
+        setup_database()
+        first_item = (db.session.query(db.func.max(Item.id)).scalar() or 0) + 1
+        bulk(Customer.__table__, [
+            {'id': i, 'username': 'user%d' % i, 'email': 'user%d@bench.test' % i,
+             'password_hash': password_hash, 'date_joined': now}
+            for i in range(1, args.customers + 1)
+        ])
+        item_ids = list(range(first_item, first_item + args.items))
+        bulk(Item.__table__, [
+            {'id': i, 'name': '%s %s %d' % (rnd.choice(SEARCH_WORDS).title(), rnd.choice(SEARCH_WORDS), i),
+             'current_price': rnd.randint(100, 50000), 'previous_price': rnd.randint(100, 60000),
+             'remaining': 1000000, 'image': None, 'date_added': now - timedelta(minutes=i)}
+            for i in item_ids
+        ])
+
+        def customer():
+            return rnd.randint(1, args.customers)
+
+        bulk(Review.__table__, [
+            {'customer_id': customer(), 'item_id': rnd.choice(item_ids), 'rating': rnd.randint(1, 5),
+             'comment': 'review %d' % n, 'created_at': now - timedelta(seconds=n)}
+            for n in range(args.reviews)
+        ])
+        wishlist = {(customer(), rnd.choice(item_ids)) for _ in range(args.wishlist)}
+        bulk(Wishlist.__table__, [{'customer_id': c, 'item_id': i} for c, i in wishlist])
+        cart = {(customer(), rnd.choice(item_ids)) for _ in range(args.cart_lines)}
+        bulk(CartItem.__table__, [
+            {'customer_link': c, 'item_id': i, 'item_name': 'item %d' % i, 'price': 100, 'quantity': 1}
+            for c, i in cart
+        ])
+        bulk(Order.__table__, [
+            {'id': n, 'customer_id': customer(), 'total_amount': 300, 'status': 'Delivered',
+             'date_created': now - timedelta(hours=n)}
+            for n in range(1, args.orders + 1)
+        ])
+        bulk(OrderItem.__table__, [
+            {'order_id': n, 'product_id': rnd.choice(item_ids), 'quantity': 1, 'price': 100}
+            for n in range(1, args.orders + 1) for _ in range(3)
+        ])
+        db.session.commit()
+        ratings.rebuild()
+        catalog_cache.bump()
+    return item_ids
+
+
+# ---------------- SIMULATED USERS ----------------
+class TestClientSession:
+    # same calls as requests.Session, backed by app.test_client()
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path):
+        return self.client.get(path).status_code
+
+    def post(self, path, data=None, json=None):
+        return self.client.post(path, data=data, json=json).status_code
+
+
+class HttpSession:
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def get(self, path):
+        return self.session.get(self.base_url + path, allow_redirects=False).status_code
+
+    def post(self, path, data=None, json=None):
+        return self.session.post(self.base_url + path, data=data, json=json,
+                                 allow_redirects=False).status_code
+
+
+def shopper(n, make_session, item_ids, args, deadline, results):
+    rnd = random.Random(args.seed * 1000 + n)
+    labels = list(ROUTES)
+    weights = [ROUTES[label][0] for label in labels]
+    session = make_session()
+    customer = n % args.customers + 1
+    session.post('/', data={'email': 'user%d@bench.test' % customer, 'password': PASSWORD})
+
+    def request(label):
+        item = rnd.choice(item_ids)
+        if label == 'amazon':
+            return session.get('/amazon/')
+        if label == 'search':
+            return session.get('/search?query=%s&page=%d' % (rnd.choice(SEARCH_WORDS), rnd.randint(1, 3)))
+        if label == 'product_detail':
+            return session.get('/product/%d' % item)
+        if label == 'cart':
+            return session.get('/cart/')
+        if label == 'cart_add':
+            return session.post('/cart/batch', json={'ops': [{'op': 'add', 'item_id': item, 'qty': 1}]})
+        if label == 'wishlist':
+            return session.get('/wishlist')
+        if label == 'wishlist_toggle':
+            return session.post('/wishlist/toggle/%d' % item)
+        if label == 'myorders':
+            return session.get('/myorders')
+        if label == 'card_intent':
+            return session.post('/create-card-intent')
+        return session.get('/success?key=%s' % uuid4().hex)
+
+    while time.perf_counter() < deadline:
+        label = rnd.choices(labels, weights)[0]
+        started = time.perf_counter()
+        try:
+            ok = request(label) < 500
+        except Exception:
+            ok = False
+        results.append((label, time.perf_counter() - started, ok))
+
+
+def serve(app):
+    from werkzeug.serving import make_server
+    # one access-log line per request would bury the report
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:%d' % server.server_port
+
+
+# ---------------- REPORT ----------------
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(results, elapsed, request_metrics):
+    routes = {}
+    for label in ROUTES:
+        timings = sorted(t for l, t, ok in results if l == label)
+        if not timings:
+            continue
+        queries = request_metrics.queries.get(ROUTES[label][1])
+        routes[label] = {
+            'requests': len(timings),
+            'errors': sum(1 for l, t, ok in results if l == label and not ok),
+            'rps': round(len(timings) / elapsed, 1),
+            'p50_ms': round(percentile(timings, 50) * 1000, 2),
+            'p95_ms': round(percentile(timings, 95) * 1000, 2),
+            'p99_ms': round(percentile(timings, 99) * 1000, 2),
+            'mean_ms': round(statistics.mean(timings) * 1000, 2),
+            'queries_per_request': round(queries.sum / queries.total, 2) if queries and queries.total else None,
+        }
+    return {
+        'total_requests': len(results),
+        'rps': round(len(results) / elapsed, 1),
+        'errors': sum(1 for l, t, ok in results if not ok),
+        'routes': routes,
+    }
+
+
+def print_report(report, baseline=None):
+    print('%-16s %8s %6s %8s %8s %8s %8s %9s' % (
+        'route', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+    for label, r in report['routes'].items():
+        line = '%-16s %8d %6d %8.1f %8.2f %8.2f %8.2f %9s' % (
+            label, r['requests'], r['errors'], r['rps'], r['p50_ms'], r['p95_ms'], r['p99_ms'],
+            r['queries_per_request'] if r['queries_per_request'] is not None else '-')
+        old = (baseline or {}).get('routes', {}).get(label)
+        if old:
+            line += '   p95 %+.1f%%  req/s %+.1f%%' % (
+                100.0 * (r['p95_ms'] - old['p95_ms']) / old['p95_ms'],
+                100.0 * (r['rps'] - old['rps']) / old['rps'])
+            if r['queries_per_request'] is not None and old.get('queries_per_request') is not None:
+                line += '  queries %+.2f' % (r['queries_per_request'] - old['queries_per_request'])
+        print(line)
+    print('total: %d requests, %.1f req/s, %d errors' % (
+        report['total_requests'], report['rps'], report['errors']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='load test the hot shop routes')
+    parser.add_argument('--mode', choices=['client', 'server'], default='client',
+                        help='Flask test client, or a real threaded WSGI server over HTTP')
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds')
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--reviews', type=int, default=20000)
+    parser.add_argument('--wishlist', type=int, default=2000)
+    parser.add_argument('--cart-lines', type=int, default=1000)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--gateway-latency-ms', type=int, default=0,
+                        help='round trip of the local stand-in payment gateway')
+    parser.add_argument('--gateway-failure-rate', type=float, default=0.0)
+    parser.add_argument('--gateway-slots', type=int, help='PAYMENT_MAX_CONCURRENT')
+    parser.add_argument('--auth-cache-ttl', type=int, default=60,
+                        help='AUTH_CACHE_TTL; 0 queries the customer on every request')
+    parser.add_argument('--db', help='database file (default: a fresh temporary one)')
+    parser.add_argument('--json', help='write the results here')
+    parser.add_argument('--compare', help='earlier --json output to compare against')
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix='shop-bench-'), 'bench.db')
+    from app import create_app
+    from metrics import request_metrics
+    config = {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.abspath(path),
+        'SECRET_KEY': 'bench',
+        'WTF_CSRF_ENABLED': False,
+        'MAIL_WORKERS': 0,
+        'METRICS_SLOW_MS': 10 ** 9,     # keep the slow-request log quiet
+        'METRICS_N_PLUS_ONE': 10 ** 9,
+        'PAYMENT_PROVIDER': 'local',
+        'PAYMENT_LOCAL_LATENCY_MS': args.gateway_latency_ms,
+        'PAYMENT_LOCAL_FAILURE_RATE': args.gateway_failure_rate,
+        'AUTH_CACHE_TTL': args.auth_cache_ttl,
+        'AUTH_HASH_QUEUE': max(args.users, 4),    # every shopper logs in at once
+        'AUTH_IP_BURST': 10 ** 6,
+    }
+    if args.gateway_slots:
+        config['PAYMENT_MAX_CONCURRENT'] = args.gateway_slots
+    app = create_app(config)
+
+    started = time.perf_counter()
+    item_ids = seed(app, args)
+    print('seeded %s in %.1fs' % (path, time.perf_counter() - started))
+
+    server = None
+    if args.mode == 'server':
+        server, base_url = serve(app)
+        make_session = lambda: HttpSession(base_url)
+    else:
+        make_session = lambda: TestClientSession(app)
+
+    results = []
+    started = time.perf_counter()
+    deadline = started + args.duration
+    users = [threading.Thread(target=shopper, args=(n, make_session, item_ids, args, deadline, results))
+             for n in range(args.users)]
+    for t in users:
+        t.start()
+    for t in users:
+        t.join()
+    elapsed = time.perf_counter() - started
+    if server is not None:
+        server.shutdown()
+
+    report = summarize(results, elapsed, request_metrics)
+    report['config'] = dict(vars(args), db=path)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    from payments import payments
+    print('payment gateway: %s' % payments.stats())
+    from auth import principals
+    print('auth cache: %s' % principals.stats())
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# bench_startup.py
+# startup latency: import app -> first response, each run in a fresh
+# interpreter so nothing is warm.
+#
+#   python bench_startup.py                # 10 runs of GET /
+#   python bench_startup.py --runs 20 --path /signup/
+#   python bench_startup.py --imports      # slowest imports (python -X importtime)
+import argparse
+import statistics
+import subprocess
+import sys
+
+CHILD = """
+import time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+app.app.config['SECRET_KEY'] = 'bench'    # the login form needs one for CSRF
+client = app.app.test_client()
+status = client.get(%r).status_code
+t2 = time.perf_counter()
+print(t1 - t0, t2 - t1, t2 - t0, status)
+"""
+
+
+def run_once(path):
+    out = subprocess.run([sys.executable, '-c', CHILD % path],
+                         capture_output=True, text=True, check=True).stdout
+    imp, first, total, status = out.split()[-4:]
+    return float(imp), float(first), float(total), int(status)
+
+
+def slowest_imports(limit):
+    # -X importtime writes "import time: self | cumulative | module" to stderr
+    err = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                         capture_output=True, text=True).stderr
+    rows = []
+    for line in err.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].rstrip()))
+    for cumulative, module in sorted(rows, reverse=True)[:limit]:
+        print('%8.1f ms  %s' % (cumulative / 1000, module))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='import -> first response latency')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='/')
+    parser.add_argument('--imports', action='store_true')
+    args = parser.parse_args()
+
+    if args.imports:
+        slowest_imports(25)
+        return
+
+    results = [run_once(args.path) for _ in range(args.runs)]
+    print('GET %s -> %d, %d runs' % (args.path, results[0][3], args.runs))
+    for i, label in enumerate(['import app', 'first request', 'import -> response']):
+        ms = [r[i] * 1000 for r in results]
+        print('%-20s min %7.1f  median %7.1f  max %7.1f ms'
+              % (label, min(ms), statistics.median(ms), max(ms)))
+
+
+if __name__ == '__main__':
+    main()
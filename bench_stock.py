@@ -0,0 +1,162 @@
+# bench_stock.py
+# flash-sale stress test for the stock reservations (inventory.py): many
+# concurrent shoppers go after a product with little stock, and the run
+# fails (exit status 1) if more units are held, carted or sold than exist.
+#
+#   python bench_stock.py                        # engine + end-to-end, 64 shoppers, 50 units
+#   python bench_stock.py --shoppers 300 --stock 20
+#   python bench_stock.py --no-reserve           # checkout's stock check alone
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+PASSWORD = 'bench-password'
+FLASH_ID = 2        # "Android smartphone" in app.flash_products
+
+
+# ---------------- ENGINE ----------------
+def stress_engine(args):
+    # threads reserve / resize / release holds on one item while a watcher
+    # checks that holds never exceed the stock
+    from inventory import Inventory
+    inv = Inventory(loader=lambda ids: {i: args.stock for i in ids}, ttl=60)
+    stop = threading.Event()
+    violations = []
+
+    def shopper(n):
+        rnd = random.Random(n)
+        owner = 'a:%d' % n
+        while not stop.is_set():
+            action = rnd.random()
+            if action < 0.6:
+                inv.reserve(owner, 1, rnd.randint(1, 3))
+            elif action < 0.9:
+                inv.release(owner, 1)
+            else:
+                inv.sweep()
+
+    def watcher():
+        while not stop.is_set():
+            stats = inv.stats()
+            if stats['units_held'] > args.stock:
+                violations.append(stats['units_held'])
+
+    threads = [threading.Thread(target=shopper, args=(n,)) for n in range(args.shoppers)]
+    threads.append(threading.Thread(target=watcher))
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    holds = sum(inv.held('a:%d' % n).get(1, 0) for n in range(args.shoppers))
+    stats = inv.stats()
+    ok = not violations and holds == stats['units_held'] <= args.stock
+    print('engine: %d units held of %d, %d refused, max seen %d -> %s' % (
+        stats['units_held'], args.stock, stats['rejected'],
+        max(violations or [stats['units_held']]), 'ok' if ok else 'OVERSOLD'))
+    return ok
+
+
+# ---------------- END TO END ----------------
+def stress_app(args):
+    # every shopper: log in, add the flash product, check out
+    from app import create_app, setup_database, flash_products
+    from db_create import db, Customer, Item, OrderItem
+    from inventory import inventory
+    from product_index import product_index
+
+    path = os.path.join(tempfile.mkdtemp(prefix='shop-stock-'), 'stock.db')
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+        'SECRET_KEY': 'bench',
+        'WTF_CSRF_ENABLED': False,
+        'MAIL_WORKERS': 0,
+        'RESERVE_ENABLED': not args.no_reserve,
+        'METRICS_SLOW_MS': 10 ** 9,
+        'AUTH_HASH_QUEUE': args.shoppers,   # everybody logs in at once, from one address
+        'AUTH_IP_BURST': 10 ** 6,
+    })
+    with app.app_context():
+        setup_database()
+        password_hash = generate_password_hash(PASSWORD)
+        db.session.execute(insert(Customer.__table__), [
+            {'username': 'shopper%d' % n, 'email': 'shopper%d@bench.test' % n,
+             'password_hash': password_hash} for n in range(args.shoppers)
+        ])
+        item_id = product_index.id_for_name(flash_products[FLASH_ID][0])
+        Item.query.get(item_id).remaining = args.stock
+        db.session.commit()
+
+    outcome = {'carted': 0, 'refused': 0, 'errors': 0}
+    lock = threading.Lock()
+    start = threading.Barrier(args.shoppers)
+
+    def shopper(n):
+        client = app.test_client()
+        try:
+            client.post('/', data={'email': 'shopper%d@bench.test' % n, 'password': PASSWORD})
+            start.wait(60)      # everybody clicks at once
+            client.get('/add_to_cart/%d' % FLASH_ID)
+            carted = b'Android smartphone' in client.get('/cart/').data
+            if carted:
+                client.get('/success?key=stock-%d' % n)
+            result = 'carted' if carted else 'refused'
+        except Exception as e:
+            print('shopper %d: %r' % (n, e))
+            result = 'errors'
+        with lock:
+            outcome[result] += 1
+
+    threads = [threading.Thread(target=shopper, args=(n,)) for n in range(args.shoppers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        sold = db.session.query(db.func.coalesce(db.func.sum(OrderItem.quantity), 0)) \
+            .filter(OrderItem.product_id == item_id).scalar()
+        remaining = Item.query.get(item_id).remaining
+        orders = db.session.query(db.func.count(db.distinct(OrderItem.order_id))) \
+            .filter(OrderItem.product_id == item_id).scalar()
+    held = inventory.stats()['units_held']
+    ok = sold <= args.stock and remaining >= 0 and sold + remaining == args.stock
+    # with reservations nobody may even get the product into the cart unless
+    # a unit is there for them
+    ok = ok and (args.no_reserve or outcome['carted'] <= args.stock)
+    print('app (%s): %d shoppers in %.1fs, %d got it in the cart, %d refused, '
+          '%d ordered, %d failed at checkout, %d errors' % (
+              'no reservations' if args.no_reserve else 'reservations', args.shoppers, elapsed,
+              outcome['carted'], outcome['refused'], orders, outcome['carted'] - orders,
+              outcome['errors']))
+    print('app: %d of %d units sold, %d left, %d still held -> %s' % (
+        sold, args.stock, remaining, held, 'ok' if ok else 'OVERSOLD'))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='flash-sale oversell stress test')
+    parser.add_argument('--shoppers', type=int, default=64)
+    parser.add_argument('--stock', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=3.0, help='seconds of the engine test')
+    parser.add_argument('--no-reserve', action='store_true', help='end-to-end run without reservations')
+    args = parser.parse_args()
+
+    ok = stress_engine(args)
+    ok = stress_app(args) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# bench_writes.py
+# write throughput of wishlist toggles and reviews: concurrent customers
+# click as fast as they can, with group commit (write_queue.py) or with one
+# commit per request. afterwards every customer's wishlist and review count
+# is checked against what their clicks were told; exit status 1 on mismatch.
+#
+#   python bench_writes.py                          # group commit, 5 ms batches
+#   python bench_writes.py --batch-interval-ms 0    # commit per request
+#   python bench_writes.py --users 32 --duration 10 --reviews 0.2
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+PASSWORD = 'bench-password'
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * p / 100.0), len(sorted_values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='wishlist / review write throughput')
+    parser.add_argument('--users', type=int, default=16)
+    parser.add_argument('--items', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds')
+    parser.add_argument('--reviews', type=float, default=0.1, help='share of clicks that post a review')
+    parser.add_argument('--batch-interval-ms', type=float, default=5, help='WRITE_BATCH_INTERVAL (0: commit per request)')
+    args = parser.parse_args()
+
+    from app import create_app, setup_database
+    from db_create import db, Customer, Item, Review, Wishlist
+    from write_queue import write_queue
+
+    path = os.path.join(tempfile.mkdtemp(prefix='shop-writes-'), 'writes.db')
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+        'SECRET_KEY': 'bench',
+        'WTF_CSRF_ENABLED': False,
+        'MAIL_WORKERS': 0,
+        'METRICS_SLOW_MS': 10 ** 9,
+        'AUTH_HASH_QUEUE': args.users,
+        'AUTH_IP_BURST': 10 ** 6,
+        'WRITE_BATCH_INTERVAL': args.batch_interval_ms,
+    })
+    with app.app_context():
+        setup_database()
+        password_hash = generate_password_hash(PASSWORD)
+        db.session.execute(insert(Customer.__table__), [
+            {'username': 'user%d' % n, 'email': 'user%d@bench.test' % n,
+             'password_hash': password_hash} for n in range(args.users)
+        ])
+        first = (db.session.query(db.func.max(Item.id)).scalar() or 0) + 1
+        item_ids = list(range(first, first + args.items))
+        db.session.execute(insert(Item.__table__), [
+            {'id': i, 'name': 'bench item %d' % i, 'current_price': 100, 'previous_price': 100,
+             'remaining': 1000} for i in item_ids
+        ])
+        db.session.commit()
+        customer_ids = dict(db.session.query(Customer.email, Customer.id))
+
+    lock = threading.Lock()
+    timings = {'toggle': [], 'review': []}
+    expected = {}       # customer id -> (saved item ids, reviews posted)
+    errors = []
+    start = threading.Barrier(args.users)
+
+    def customer(n):
+        rnd = random.Random(n)
+        client = app.test_client()
+        email = 'user%d@bench.test' % n
+        client.post('/', data={'email': email, 'password': PASSWORD})
+        saved, reviews = set(), 0
+        start.wait(60)
+        deadline = time.perf_counter() + args.duration
+        while time.perf_counter() < deadline:
+            item = rnd.choice(item_ids)
+            started = time.perf_counter()
+            if rnd.random() < args.reviews:
+                label = 'review'
+                response = client.post('/product/%d/review' % item, data={'rating': rnd.randint(1, 5), 'comment': 'ok'})
+                ok = response.status_code == 302
+                reviews += ok
+            else:
+                label = 'toggle'
+                response = client.post('/wishlist/toggle/%d' % item)
+                ok = response.status_code == 200
+                if ok:
+                    (saved.add if response.get_json()['status'] == 'added' else saved.discard)(item)
+            elapsed = time.perf_counter() - started
+            with lock:
+                timings[label].append(elapsed)
+                if not ok:
+                    errors.append(response.status_code)
+        with lock:
+            expected[customer_ids[email]] = (saved, reviews)
+
+    threads = [threading.Thread(target=customer, args=(n,)) for n in range(args.users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with app.app_context():
+        write_queue.flush()
+        mismatched = 0
+        for customer_id, (saved, reviews) in expected.items():
+            in_db = {i for i, in db.session.query(Wishlist.item_id).filter(Wishlist.customer_id == customer_id)}
+            posted = Review.query.filter_by(customer_id=customer_id).count()
+            mismatched += in_db != saved or posted != reviews
+
+    mode = 'commit per request' if not args.batch_interval_ms else 'group commit, %g ms batches' % args.batch_interval_ms
+    total = sum(len(t) for t in timings.values())
+    print('%s: %d users, %d writes in %.1fs -> %.0f writes/s, %d errors' % (
+        mode, args.users, total, args.duration, total / args.duration, len(errors)))
+    for label, values in timings.items():
+        values.sort()
+        print('  %-7s %6d   p50 %6.1f ms   p95 %6.1f ms   p99 %6.1f ms' % (
+            label, len(values), percentile(values, 50) * 1000, percentile(values, 95) * 1000,
+            percentile(values, 99) * 1000))
+    stats = write_queue.stats()
+    if stats['batches']:
+        print('  %d transactions, %.1f writes each, %d failed' % (
+            stats['batches'], stats['writes'] / float(stats['batches']), stats['failed']))
+    print('wishlists and reviews match the clicks: %s' % ('ok' if not mismatched else '%d customers differ' % mismatched))
+    sys.exit(1 if mismatched or errors else 0)
+
+
+if __name__ == '__main__':
+    main()
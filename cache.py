@@ -0,0 +1,233 @@
+# cache.py
+# read-through cache for catalogue data: TTL + LRU, versioned keys,
+# in-process by default or shared through a redis-style client
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from db_create import Item, Review
+
+MISSING = object()
+
+
+# ---------------- BACKENDS ----------------
+class LocalCache:
+    # per-process LRU dict; every entry carries its own expiry time
+    def __init__(self, maxsize=2048, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._counters = {}     # never evicted (catalogue version lives here)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (ttl or self.ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def counter(self, key):
+        return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SharedCache:
+    # any redis-py compatible client (get / set(ex=) / incr / delete);
+    # lets several workers share entries and the catalogue version
+    def __init__(self, client, prefix='shop:', ttl=300):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.evictions = 0      # the server does its own LRU
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return MISSING
+        return pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl or self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def counter(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+# ---------------- CATALOGUE CACHE ----------------
+class CatalogCache:
+    VERSION_KEY = 'catalog:version'
+    REVIEWS_KEY = 'reviews:version:%d'
+
+    def __init__(self, backend=None):
+        self.backend = backend or LocalCache()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def version(self):
+        return self.backend.counter(self.VERSION_KEY)
+
+    def key(self, name):
+        # old versions are never read again and age out of the LRU
+        return 'catalog:v%d:%s' % (self.version(), name)
+
+    def get_or_load(self, name, loader, ttl=None):
+        # loader results of None are not cached (e.g. unknown product id)
+        key = self.key(name)
+        value = self.backend.get(key)
+        if value is not MISSING:
+            with self._lock:
+                self.hits += 1
+            return value
+        with self._lock:
+            self.misses += 1
+        value = loader()
+        if value is not None:
+            self.backend.set(key, value, ttl)
+        return value
+
+    def bump(self):
+        # call after any catalogue write; every cached key changes at once
+        return self.backend.incr(self.VERSION_KEY)
+
+    def review_version(self, item_id):
+        return self.backend.counter(self.REVIEWS_KEY % item_id)
+
+    def bump_reviews(self, item_id):
+        # one item's reviews changed; the rest of the catalogue stays cached
+        return self.backend.incr(self.REVIEWS_KEY % item_id)
+
+    def validator(self):
+        # for HTTP validators: changes whenever cached catalogue data may have.
+        # a per-process cache never hears about other workers' writes and only
+        # catches up as entries expire, so its validators expire with them
+        version = self.version()
+        if isinstance(self.backend, LocalCache):
+            return '%d.%d' % (version, time.time() // self.backend.ttl)
+        return str(version)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'version': self.version(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'evictions': self.backend.evictions,
+            'size': len(self.backend),
+        }
+
+
+catalog_cache = CatalogCache()
+
+
+def init_cache(app):
+    # CACHE_REDIS_URL switches to the shared backend (needs the redis package)
+    maxsize = app.config.get('CACHE_MAXSIZE', 2048)
+    ttl = app.config.get('CACHE_TTL', 300)
+    url = app.config.get('CACHE_REDIS_URL')
+    if url:
+        import redis
+        catalog_cache.backend = SharedCache(redis.Redis.from_url(url), ttl=ttl)
+    else:
+        catalog_cache.backend = LocalCache(maxsize=maxsize, ttl=ttl)
+    watch_catalog()
+
+
+# ---------------- INVALIDATION ----------------
+# ORM writes to Item (Review) mark the session; the version is bumped only
+# once the transaction commits. bulk SQL writes must call catalog_cache.bump()
+# themselves
+def _mark_dirty(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['catalog_dirty'] = True
+
+
+def _mark_reviews(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('reviews_dirty', set()).add(target.item_id)
+
+
+def _after_commit(session):
+    if session.info.pop('catalog_dirty', False):
+        catalog_cache.bump()
+    for item_id in session.info.pop('reviews_dirty', ()):
+        catalog_cache.bump_reviews(item_id)
+
+
+def _after_rollback(session):
+    session.info.pop('catalog_dirty', None)
+    session.info.pop('reviews_dirty', None)
+
+
+def watch_catalog():
+    if event.contains(Item, 'after_insert', _mark_dirty):
+        return
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(Item, name, _mark_dirty)
+        event.listen(Review, name, _mark_reviews)
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_rollback', _after_rollback)
+
+
+def item_record(item):
+    # plain dict copy of an Item, safe to keep outside the session
+    return {
+        'id': item.id,
+        'name': item.name,
+        'current_price': item.current_price,
+        'previous_price': item.previous_price,
+        'remaining': item.remaining,
+        'image': item.image,
+        'date_added': item.date_added,
+    }
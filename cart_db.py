@@ -0,0 +1,145 @@
+# cart_db.py
+# cart writes as single server-side statements (no read-modify-write)
+from sqlalchemy import text
+
+from db_create import db, CartItem
+
+# insert the line or bump its quantity, name/price copied from the item row
+UPSERT_LINE = text("""
+INSERT INTO cart_item (customer_link, item_id, item_name, price, quantity)
+SELECT :cid, id, name, current_price, :qty FROM item WHERE id = :item_id
+ON CONFLICT (customer_link, item_id) DO UPDATE SET quantity = quantity + excluded.quantity
+""")
+
+SET_QTY = text("""
+UPDATE cart_item SET quantity = :qty
+WHERE customer_link = :cid AND item_id = :item_id
+""")
+
+INCREMENT = text("""
+UPDATE cart_item SET quantity = quantity + 1
+WHERE customer_link = :cid AND item_id = :item_id
+""")
+
+# only decrements while it stays >= 1 ...
+DECREMENT = text("""
+UPDATE cart_item SET quantity = quantity - 1
+WHERE customer_link = :cid AND item_id = :item_id AND quantity > 1
+""")
+
+# ... the last unit removes the line
+DELETE_LAST = text("""
+DELETE FROM cart_item
+WHERE customer_link = :cid AND item_id = :item_id AND quantity <= 1
+""")
+
+INSERT_LINE = text("""
+INSERT INTO cart_item (customer_link, item_id, item_name, price, quantity)
+VALUES (:cid, :item_id, :name, :price, :qty)
+""")
+
+
+class CartError(Exception):
+    pass
+
+
+# ---------------- SINGLE OPERATIONS ----------------
+# the _ versions don't commit so batches can share one transaction
+def _add(customer_id, item_id, qty=1):
+    if qty < 1:
+        raise CartError('Quantity must be at least 1')
+    res = db.session.execute(UPSERT_LINE, {'cid': customer_id, 'item_id': item_id, 'qty': qty})
+    if res.rowcount == 0:
+        raise CartError('Product %s not found' % item_id)
+
+
+def _set(customer_id, item_id, qty):
+    if qty < 1:
+        return _remove(customer_id, item_id)
+    db.session.execute(SET_QTY, {'cid': customer_id, 'item_id': item_id, 'qty': qty})
+
+
+def _remove(customer_id, item_id):
+    return CartItem.query.filter_by(customer_link=customer_id, item_id=item_id) \
+        .delete(synchronize_session=False) > 0
+
+
+def add(customer_id, item_id, qty=1):
+    _add(customer_id, item_id, qty)
+    db.session.commit()
+
+
+def increase(customer_id, item_id):
+    # returns False if the product isn't in this customer's cart
+    res = db.session.execute(INCREMENT, {'cid': customer_id, 'item_id': item_id})
+    db.session.commit()
+    return res.rowcount > 0
+
+
+def decrease(customer_id, item_id):
+    params = {'cid': customer_id, 'item_id': item_id}
+    changed = db.session.execute(DECREMENT, params).rowcount
+    if not changed:
+        changed = db.session.execute(DELETE_LAST, params).rowcount
+    db.session.commit()
+    return changed > 0
+
+
+def set_quantity(customer_id, item_id, qty):
+    _set(customer_id, item_id, qty)
+    db.session.commit()
+
+
+def remove(customer_id, item_id):
+    removed = _remove(customer_id, item_id)
+    db.session.commit()
+    return removed
+
+
+# ---------------- BATCH ----------------
+BATCH_OPS = {
+    'add': lambda cid, op: _add(cid, int(op['item_id']), int(op.get('qty', 1))),
+    'set': lambda cid, op: _set(cid, int(op['item_id']), int(op['qty'])),
+    'remove': lambda cid, op: _remove(cid, int(op['item_id'])),
+}
+
+
+def apply_batch(customer_id, ops):
+    # [{"op": "add"|"set"|"remove", "item_id": 3, "qty": 2}, ...]
+    # all applied in one transaction, or none of them on error
+    try:
+        for op in ops:
+            handler = BATCH_OPS.get(op.get('op'))
+            if handler is None:
+                raise CartError('Unknown cart operation %r' % op.get('op'))
+            handler(customer_id, op)
+    except (KeyError, TypeError, ValueError) as e:
+        db.session.rollback()
+        raise CartError('Malformed cart operation: %s' % e)
+    except CartError:
+        db.session.rollback()
+        raise
+    db.session.commit()
+
+
+def quantities(customer_id):
+    # {item_id: quantity} for one customer
+    return dict(db.session.query(CartItem.item_id, CartItem.quantity)
+                .filter(CartItem.customer_link == customer_id))
+
+
+def replace_carts(carts):
+    # write-behind flush: {customer_id: [(item_id, name, price, qty), ...]}
+    # replaces those customers' lines with one DELETE and one executemany
+    if not carts:
+        return
+    CartItem.query.filter(CartItem.customer_link.in_(list(carts))) \
+        .delete(synchronize_session=False)
+    rows = [
+        {'cid': cid, 'item_id': item_id, 'name': name, 'price': price, 'qty': qty}
+        for cid, lines in carts.items()
+        for item_id, name, price, qty in lines
+    ]
+    if rows:
+        db.session.execute(INSERT_LINE, rows)
+    db.session.commit()
@@ -0,0 +1,466 @@
+# cart_store.py
+# where carts live between clicks. anonymous carts sit in a key-value store
+# (in-process, or redis via CART_REDIS_URL). with redis, hot customer carts
+# live there too and are written to cart_item in batches by a background
+# thread; without it they go straight to cart_item
+import atexit
+import threading
+import time
+
+from db_create import db, Item
+from cache import item_record
+import cart_db
+from cart_db import CartError
+from inventory import inventory, NotEnoughStock
+
+HOT_TTL = 30 * 60           # idle customer cart, reloaded from cart_item after
+ANON_TTL = 7 * 24 * 3600    # idle anonymous cart, gone after
+DIRTY = 'cart:dirty'        # customer ids with changes not yet in cart_item
+LOADED = '_'                # marker field: customer cart was loaded from the db
+
+
+# ---------------- KV BACKENDS ----------------
+class MemoryKV:
+    # in-process stand-in for the few redis hash/set commands used here
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.RLock()
+
+    def _live(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires < time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._data
+
+    def exists(self, key):
+        with self._lock:
+            return self._live(key)
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._data[key]) if self._live(key) else {}
+
+    def hset(self, key, field, value):
+        with self._lock:
+            self._live(key)
+            self._data.setdefault(key, {})[field] = int(value)
+
+    def hincrby(self, key, field, amount):
+        with self._lock:
+            self._live(key)
+            h = self._data.setdefault(key, {})
+            h[field] = h.get(field, 0) + amount
+            return h[field]
+
+    def hdel(self, key, field):
+        with self._lock:
+            if self._live(key):
+                return self._data[key].pop(field, None) is not None
+            return False
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+
+    def expire(self, key, seconds):
+        with self._lock:
+            self._expires[key] = time.monotonic() + seconds
+
+    def sadd(self, key, member):
+        with self._lock:
+            self._data.setdefault(key, set()).add(member)
+
+    def spop_all(self, key):
+        with self._lock:
+            return self._data.pop(key, set())
+
+    def sweep(self):
+        with self._lock:
+            for key in list(self._expires):
+                self._live(key)
+
+
+class RedisKV:
+    # thin adapter over a redis-py client, shared by every worker
+    def __init__(self, client):
+        self.client = client
+
+    def exists(self, key):
+        return bool(self.client.exists(key))
+
+    def hgetall(self, key):
+        return {k.decode(): int(v) for k, v in self.client.hgetall(key).items()}
+
+    def hset(self, key, field, value):
+        self.client.hset(key, field, value)
+
+    def hincrby(self, key, field, amount):
+        return self.client.hincrby(key, field, amount)
+
+    def hdel(self, key, field):
+        return bool(self.client.hdel(key, field))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def expire(self, key, seconds):
+        self.client.expire(key, seconds)
+
+    def sadd(self, key, member):
+        self.client.sadd(key, member)
+
+    def spop_all(self, key):
+        pipe = self.client.pipeline()
+        pipe.smembers(key)
+        pipe.delete(key)
+        members, _ = pipe.execute()
+        return {int(m) for m in members}
+
+    def sweep(self):
+        pass    # redis expires keys itself
+
+
+def load_products(ids):
+    # {item_id: item record} with one IN (...) query - fresh price and stock
+    if not ids:
+        return {}
+    return {i.id: item_record(i) for i in Item.query.filter(Item.id.in_(ids))}
+
+
+# ---------------- CART STORE ----------------
+# owners: "u:<customer id>" for customers, "a:<session token>" for anonymous
+def user_owner(customer_id):
+    return 'u:%d' % customer_id
+
+
+def anon_owner(token):
+    return 'a:%s' % token
+
+
+class CartLimit(CartError):
+    pass
+
+
+class CartStore:
+    def __init__(self, kv=None, write_behind=True, product_loader=load_products,
+                 inventory=inventory, max_line_qty=10, max_units=50):
+        self.kv = kv or MemoryKV()
+        # False: customer carts go straight to cart_item (anonymous carts
+        # still live in the kv store, they have no customer row)
+        self.write_behind = write_behind
+        # display data, existence checks and the names / prices written by
+        # flush() all come from one batched db query: the product index is
+        # per process and does not see imports or price changes made elsewhere
+        self.product_loader = product_loader
+        # stock holds for customer cart lines (None: no reservations). guest
+        # carts are only checked against what is free: one scripted session
+        # could otherwise hold a flash sale's stock; their lines take holds
+        # when merged on login
+        self.inventory = inventory
+        # most units of one product per line / in one cart
+        self.max_line_qty = max_line_qty
+        self.max_units = max_units
+        self._load_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def _customer(self, owner):
+        return int(owner[2:]) if owner.startswith('u:') else None
+
+    def _in_db(self, owner):
+        return not self.write_behind and owner.startswith('u:')
+
+    def _key(self, owner):
+        # make sure the cart is in the kv store and refresh its idle timer
+        key = 'cart:' + owner
+        cid = self._customer(owner)
+        if cid is not None and not self.kv.exists(key):
+            with self._load_lock:
+                if not self.kv.exists(key):
+                    self.kv.hset(key, LOADED, 1)
+                    for item_id, qty in cart_db.quantities(cid).items():
+                        if item_id is not None:
+                            self.kv.hset(key, str(item_id), qty)
+        self.kv.expire(key, HOT_TTL if cid is not None else ANON_TTL)
+        return key
+
+    def _changed(self, owner):
+        cid = self._customer(owner)
+        if cid is not None:
+            self.kv.sadd(DIRTY, cid)
+
+    def _check_products(self, ids):
+        missing = set(ids) - set(self.product_loader(list(set(ids))))
+        if missing:
+            raise CartError('Product %s not found' % min(missing))
+
+    def _current(self, owner, item_id):
+        return self.quantities(owner).get(item_id, 0)
+
+    def _reserve(self, owner, item_id, qty):
+        # hold stock for the line's new quantity before the line changes
+        self._reserve_all(owner, {item_id: max(qty, 0)})
+
+    def _check_limits(self, owner, wanted):
+        # {item_id: new line quantity} against the per-line and per-cart caps;
+        # shrinking a cart that is over them is always allowed
+        current = self.quantities(owner)
+        if any(qty > self.max_line_qty and qty > current.get(i, 0) for i, qty in wanted.items()):
+            raise CartLimit('At most %d of one product per order' % self.max_line_qty)
+        units = dict(current)
+        units.update(wanted)
+        if sum(units.values()) > max(self.max_units, sum(current.values())):
+            raise CartLimit('A cart can hold at most %d items' % self.max_units)
+
+    def _reserve_all(self, owner, wanted):
+        # {item_id: new line quantity}, held in one step or not at all
+        self._check_limits(owner, wanted)
+        if self.inventory is None:
+            return
+        if self._customer(owner) is None:
+            short = next((i for i, qty in wanted.items()
+                          if qty > self.inventory.available(i)), None)
+        else:
+            short = self.inventory.reserve_many(owner, wanted)
+        if short is not None:
+            raise NotEnoughStock('Only %d left of this product' % (
+                self.inventory.available(short) + self.inventory.held(owner).get(short, 0)))
+
+    # ---- reads ----
+    def quantities(self, owner):
+        # {item_id: quantity}
+        if self._in_db(owner):
+            return {i: q for i, q in cart_db.quantities(self._customer(owner)).items() if i}
+        return {int(f): q for f, q in self.kv.hgetall(self._key(owner)).items()
+                if f != LOADED and q > 0}
+
+    def lines(self, owner):
+        # display rows: product data resolved with one batched lookup
+        qtys = self.quantities(owner)
+        products = self.product_loader(list(qtys))
+        lines = []
+        for item_id, qty in qtys.items():
+            p = products.get(item_id)
+            if p is None:
+                continue
+            lines.append({
+                'id': item_id,
+                'item_id': item_id,
+                'item_name': p['name'],
+                'price': p['current_price'],
+                'image': p['image'],
+                'remaining': p['remaining'],
+                'quantity': qty,
+            })
+        return lines
+
+    # ---- writes ----
+    def add(self, owner, item_id, qty=1):
+        if qty < 1:
+            raise CartError('Quantity must be at least 1')
+        self._check_products([item_id])
+        self._reserve(owner, item_id, self._current(owner, item_id) + qty)
+        if self._in_db(owner):
+            return cart_db.add(self._customer(owner), item_id, qty)
+        self.kv.hincrby(self._key(owner), str(item_id), qty)
+        self._changed(owner)
+
+    def increase(self, owner, item_id):
+        current = self._current(owner, item_id)
+        if current:
+            self._reserve(owner, item_id, current + 1)
+        if self._in_db(owner):
+            return cart_db.increase(self._customer(owner), item_id)
+        key = self._key(owner)
+        if str(item_id) not in self.kv.hgetall(key):
+            return False
+        self.kv.hincrby(key, str(item_id), 1)
+        self._changed(owner)
+        return True
+
+    def decrease(self, owner, item_id):
+        # at quantity 1 the line is removed
+        current = self._current(owner, item_id)
+        if current:
+            self._reserve(owner, item_id, current - 1)
+        if self._in_db(owner):
+            return cart_db.decrease(self._customer(owner), item_id)
+        key = self._key(owner)
+        if str(item_id) not in self.kv.hgetall(key):
+            return False
+        if self.kv.hincrby(key, str(item_id), -1) < 1:
+            self.kv.hdel(key, str(item_id))
+        self._changed(owner)
+        return True
+
+    def set(self, owner, item_id, qty):
+        current = 0
+        if qty >= 1:
+            self._check_products([item_id])
+            current = self._current(owner, item_id)
+            self._reserve(owner, item_id, qty)
+        if self._in_db(owner):
+            # cart_db's set only changes an existing line
+            if qty >= 1 and not current:
+                return cart_db.add(self._customer(owner), item_id, qty)
+            return cart_db.set_quantity(self._customer(owner), item_id, qty)
+        if qty < 1:
+            return self.remove(owner, item_id)
+        self.kv.hset(self._key(owner), str(item_id), qty)
+        self._changed(owner)
+
+    def remove(self, owner, item_id):
+        if self.inventory is not None:
+            self.inventory.release(owner, item_id)
+        if self._in_db(owner):
+            return cart_db.remove(self._customer(owner), item_id)
+        removed = self.kv.hdel(self._key(owner), str(item_id))
+        self._changed(owner)
+        return removed
+
+    def apply_batch(self, owner, ops):
+        # validate everything and hold stock for the resulting quantities in
+        # one step first, so a bad op or a short product changes nothing
+        try:
+            parsed = []
+            for op in ops:
+                name = op.get('op')
+                if name not in ('add', 'set', 'remove'):
+                    raise CartError('Unknown cart operation %r' % name)
+                qty = int(op.get('qty', 1)) if name != 'remove' else 0
+                if name == 'add' and qty < 1:
+                    raise CartError('Quantity must be at least 1')
+                parsed.append((name, int(op['item_id']), qty))
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            raise CartError('Malformed cart operation: %s' % e)
+        self._check_products([item_id for name, item_id, qty in parsed
+                              if name == 'add' or name == 'set' and qty >= 1])
+
+        current = self.quantities(owner)
+        final = {}
+        for name, item_id, qty in parsed:
+            if name == 'add':
+                final[item_id] = final.get(item_id, current.get(item_id, 0)) + qty
+            else:
+                final[item_id] = max(qty, 0)
+        self._reserve_all(owner, final)
+
+        if self._in_db(owner):
+            # the final quantities, as ops cart_db applies in one transaction
+            return cart_db.apply_batch(self._customer(owner), [
+                {'op': 'set' if item_id in current else 'add', 'item_id': item_id, 'qty': qty}
+                if qty > 0 else {'op': 'remove', 'item_id': item_id}
+                for item_id, qty in final.items()])
+        key = self._key(owner)
+        for item_id, qty in final.items():
+            if qty > 0:
+                self.kv.hset(key, str(item_id), qty)
+            else:
+                self.kv.hdel(key, str(item_id))
+        self._changed(owner)
+
+    def clear(self, owner):
+        # drop the kv copy; customer carts reload from cart_item next time.
+        # held stock goes back (after a checkout see Inventory.sold)
+        if self.inventory is not None:
+            self.inventory.release(owner)
+        self.kv.delete('cart:' + owner)
+
+    def merge(self, src, dst):
+        # anonymous cart -> customer cart on login, persisted right away.
+        # line by line, each one reserved for dst before it is written (guest
+        # lines hold no stock); lines that no longer fit - stock gone, cart
+        # limits - are left out and reported once the rest is merged
+        qtys = self.quantities(src)
+        existing = self.product_loader(list(qtys))
+        dropped = len(qtys) - len(existing)
+        for item_id, qty in qtys.items():
+            if item_id not in existing:
+                continue
+            try:
+                self._reserve(dst, item_id, self._current(dst, item_id) + qty)
+            except CartError:
+                dropped += 1
+                continue
+            if self._in_db(dst):
+                cart_db.add(self._customer(dst), item_id, qty)
+            else:
+                self.kv.hincrby(self._key(dst), str(item_id), qty)
+                self._changed(dst)
+        self.flush()
+        self.clear(src)
+        if dropped:
+            raise NotEnoughStock('%d product(s) from your cart could not be kept' % dropped)
+
+    # ---- write-behind ----
+    def flush(self):
+        # write every dirty customer cart to cart_item in one transaction
+        with self._flush_lock:
+            cids = self.kv.spop_all(DIRTY)
+            if not cids:
+                return 0
+            try:
+                snapshot = {}
+                for cid in cids:
+                    h = self.kv.hgetall('cart:' + user_owner(cid))
+                    if h:
+                        snapshot[cid] = {int(f): q for f, q in h.items() if f != LOADED and q > 0}
+                # lines whose product was deleted meanwhile are dropped
+                products = self.product_loader(list({i for q in snapshot.values() for i in q}))
+                cart_db.replace_carts({
+                    cid: [(i, products[i]['name'], products[i]['current_price'], q)
+                          for i, q in qtys.items() if i in products]
+                    for cid, qtys in snapshot.items()
+                })
+            except Exception:
+                db.session.rollback()
+                for cid in cids:
+                    self.kv.sadd(DIRTY, cid)
+                raise
+            return len(snapshot)
+
+
+cart_store = CartStore()
+
+
+def init_cart_store(app):
+    # CART_FLUSH_INTERVAL = 0 writes customer carts through to the db. write-
+    # behind needs CART_REDIS_URL: with the in-process store every worker
+    # would keep (and flush) its own copy of a cart, so it is off without one
+    # CART_MAX_LINE_QTY / CART_MAX_UNITS cap one line / one cart (default 10 / 50)
+    url = app.config.get('CART_REDIS_URL')
+    interval = app.config.get('CART_FLUSH_INTERVAL', 2.0)
+    cart_store.max_line_qty = app.config.setdefault('CART_MAX_LINE_QTY', 10)
+    cart_store.max_units = app.config.setdefault('CART_MAX_UNITS', 50)
+    if url:
+        import redis
+        cart_store.kv = RedisKV(redis.Redis.from_url(url))
+    cart_store.write_behind = bool(url) and interval > 0
+    if not app.config.get('RESERVE_ENABLED', True):
+        cart_store.inventory = None
+
+
+def start_cart_flusher(app):
+    # once per process, before serving requests
+    if cart_store.write_behind:
+        start_flusher(app, app.config.get('CART_FLUSH_INTERVAL', 2.0))
+
+
+def start_flusher(app, interval):
+    def flush():
+        with app.app_context():
+            try:
+                cart_store.flush()
+                cart_store.kv.sweep()
+            except Exception:
+                app.logger.exception('cart flush failed')
+
+    def run():
+        while True:
+            time.sleep(interval)
+            flush()
+
+    threading.Thread(target=run, name='cart-flusher', daemon=True).start()
+    atexit.register(flush)
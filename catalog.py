@@ -0,0 +1,68 @@
+# catalog.py
+# keyset-paginated catalogue listing (date_added, id) + streamed rendering
+from datetime import datetime
+
+from flask import Response, current_app, get_flashed_messages, stream_with_context
+from sqlalchemy import or_, and_
+
+from db_create import Item
+from cache import catalog_cache, item_record
+
+PAGE_SIZE = 24
+
+
+# ---------------- CURSORS ----------------
+# cursor = "<date_added iso>_<id>" of the last row on the previous page
+def encode_cursor(record):
+    return '%s_%d' % (record['date_added'].isoformat(), record['id'])
+
+
+def decode_cursor(cursor):
+    try:
+        stamp, item_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(stamp), int(item_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+# ---------------- LISTING ----------------
+def _load_page(cursor, limit):
+    q = Item.query
+    after = decode_cursor(cursor) if cursor else None
+    if after:
+        stamp, item_id = after
+        q = q.filter(or_(
+            Item.date_added > stamp,
+            and_(Item.date_added == stamp, Item.id > item_id)
+        ))
+    # served by ix_item_date_added, reads limit + 1 rows whatever the offset
+    rows = q.order_by(Item.date_added, Item.id).limit(limit + 1).all()
+
+    records = [item_record(i) for i in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(records[-1])
+    return records, next_cursor
+
+
+def items_page(cursor=None, limit=PAGE_SIZE):
+    # returns ([item records], next_cursor or None)
+    return catalog_cache.get_or_load(
+        'page:%s:%d' % (cursor or '', limit),
+        lambda: _load_page(cursor, limit)
+    )
+
+
+# ---------------- STREAMING ----------------
+def stream_template(template_name, **context):
+    # Flask < 2.2 has no stream_template: render through jinja's generator so
+    # the head of the page goes out before the product rows are rendered
+    app = current_app._get_current_object()
+    # headers (and the session cookie) are sent before the body renders, so
+    # pop flashed messages now; the template then reads the cached copy
+    get_flashed_messages(with_categories=True)
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    stream.enable_buffering(8)
+    return Response(stream_with_context(stream), mimetype='text/html')
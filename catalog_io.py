@@ -0,0 +1,310 @@
+# catalog_io.py
+# bulk catalogue import / export. rows are streamed, validated and written
+# in batches (one executemany per batch), so memory stays flat for any size.
+#
+#   flask catalog import products.csv --batch-size 2000
+#   flask catalog export --format jsonl -o products.jsonl
+#
+# rows are matched on "id" when given, otherwise on the exact product name
+import csv
+import io
+import json
+import sys
+import time
+from datetime import datetime
+from itertools import islice
+
+import click
+from flask import Response, stream_with_context
+from flask.cli import AppGroup
+
+from db_create import db, Item
+from cache import catalog_cache
+
+BATCH_SIZE = 1000
+MAX_ERRORS = 20         # rejected rows reported back, the rest only counted
+FIELDS = ['id', 'name', 'current_price', 'previous_price', 'remaining', 'image', 'date_added']
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+class RowError(ValueError):
+    pass
+
+
+# ---------------- READING ----------------
+def read_rows(stream, fmt):
+    # yields (line number, raw dict) one at a time
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_no, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_no, RowError('invalid JSON: %s' % e)
+                continue
+            yield line_no, row
+
+
+def _int(row, field, default=None):
+    value = row.get(field)
+    if value is None or value == '':
+        if default is None:
+            raise RowError('%s is required' % field)
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise RowError('%s must be a whole number' % field)
+    if value < 0:
+        raise RowError('%s must not be negative' % field)
+    return value
+
+
+def clean_row(row):
+    # raw csv/json dict -> Item column dict, or RowError
+    if isinstance(row, RowError):
+        raise row
+    if not isinstance(row, dict):
+        raise RowError('expected an object')
+
+    name = (row.get('name') or '').strip()
+    if not name:
+        raise RowError('name is required')
+    if len(name) > 150:
+        raise RowError('name is longer than 150 characters')
+
+    # only the columns the row carries: an update leaves the others alone,
+    # inserts get their defaults in upsert_batch
+    clean = {'name': name, 'current_price': _int(row, 'current_price')}
+    for field in ('previous_price', 'remaining', 'id'):
+        if row.get(field) not in (None, ''):
+            clean[field] = _int(row, field)
+    if 'image' in row:
+        image = (row['image'] or '').strip()
+        if len(image) > 300:
+            raise RowError('image is longer than 300 characters')
+        clean['image'] = image or None
+    if row.get('date_added'):
+        try:
+            clean['date_added'] = datetime.fromisoformat(row['date_added'])
+        except (TypeError, ValueError):
+            raise RowError('date_added must be an ISO date')
+    return clean
+
+
+# ---------------- IMPORT ----------------
+class ImportStats:
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.rejected = 0
+        self.errors = []
+        self.started = time.perf_counter()
+
+    def reject(self, line_no, error):
+        self.rejected += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append('line %d: %s' % (line_no, error))
+
+    @property
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.read / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        return '%d rows: %d inserted, %d updated, %d skipped, %d rejected (%.0f rows/s)' % (
+            self.read, self.inserted, self.updated, self.skipped, self.rejected, self.rate)
+
+
+def _existing_ids(rows):
+    # which rows already exist: one IN (...) query for ids, one for names
+    ids = [r['id'] for r in rows if 'id' in r]
+    names = list({r['name'] for r in rows if 'id' not in r})
+    found_ids = set()
+    if ids:
+        found_ids = {i for (i,) in db.session.query(Item.id).filter(Item.id.in_(ids))}
+    by_name = {}
+    if names:
+        rows_by_name = db.session.query(Item.name, Item.id) \
+            .filter(Item.name.in_(names)).order_by(Item.id.desc())
+        by_name = dict(rows_by_name)     # lowest id wins, same as product_index
+    return found_ids, by_name
+
+
+def insert_defaults(row):
+    # columns a new product gets when the file leaves them out
+    row.setdefault('previous_price', row['current_price'])
+    row.setdefault('remaining', 0)
+    return row
+
+
+def upsert_batch(rows, update_existing=True):
+    # returns (inserted, updated, skipped); the batch commits as one transaction
+    found_ids, by_name = _existing_ids(rows)
+    inserts, updates = {}, {}
+    for row in rows:
+        item_id = row['id'] if 'id' in row else by_name.get(row['name'])
+        # later rows for the same product win, column by column
+        if item_id is not None and (item_id in found_ids or 'id' not in row):
+            updates.setdefault(item_id, {}).update(row, id=item_id)
+        else:
+            inserts.setdefault(row.get('id', row['name']), {}).update(row)
+
+    skipped = 0
+    if not update_existing:
+        skipped, updates = len(updates), {}
+    if inserts:
+        db.session.bulk_insert_mappings(Item, [insert_defaults(r) for r in inserts.values()])
+    if updates:
+        db.session.bulk_update_mappings(Item, list(updates.values()))
+    db.session.commit()
+    # bulk writes skip the mapper events that normally bump the version
+    if inserts or updates:
+        catalog_cache.bump()
+    return len(inserts), len(updates), skipped
+
+
+def batched(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def import_items(rows, batch_size=BATCH_SIZE, update_existing=True, progress=None):
+    # rows: iterable of (line number, raw dict). progress(stats) after each batch
+    stats = ImportStats()
+    for chunk in batched(rows, batch_size):
+        valid = []
+        for line_no, raw in chunk:
+            stats.read += 1
+            try:
+                valid.append(clean_row(raw))
+            except RowError as e:
+                stats.reject(line_no, e)
+        if valid:
+            inserted, updated, skipped = upsert_batch(valid, update_existing)
+            stats.inserted += inserted
+            stats.updated += updated
+            stats.skipped += skipped
+        if progress:
+            progress(stats)
+    return stats
+
+
+# ---------------- EXPORT ----------------
+def iter_items(batch_size=BATCH_SIZE):
+    # keyset walk over item.id; only one batch of rows in memory at a time
+    columns = [getattr(Item, f) for f in FIELDS]
+    last_id = 0
+    while True:
+        rows = db.session.query(*columns).filter(Item.id > last_id) \
+            .order_by(Item.id).limit(batch_size).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def _record(row):
+    record = dict(zip(FIELDS, row))
+    if record['date_added'] is not None:
+        record['date_added'] = record['date_added'].isoformat()
+    return record
+
+
+def _chunks(fmt, batch_size):
+    # (row count, text) per batch: header + rows for csv, one object per line for jsonl
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if fmt == 'csv':
+        writer.writerow(FIELDS)
+    for rows in iter_items(batch_size):
+        for row in rows:
+            record = _record(row)
+            if fmt == 'csv':
+                writer.writerow([record[f] for f in FIELDS])
+            else:
+                buf.write(json.dumps(record) + '\n')
+        yield len(rows), buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield 0, buf.getvalue()
+
+
+def export_chunks(fmt, batch_size=BATCH_SIZE):
+    for count, text in _chunks(fmt, batch_size):
+        yield text
+
+
+def export_response(fmt):
+    # streamed download, rows are fetched while the client reads
+    return Response(
+        stream_with_context(export_chunks(fmt)),
+        mimetype=FORMATS[fmt],
+        headers={'Content-Disposition': 'attachment; filename=catalog.%s' % fmt}
+    )
+
+
+# ---------------- CLI ----------------
+catalog_cli = AppGroup('catalog', help='Bulk import / export of the product catalogue.')
+
+
+def guess_format(path, fmt):
+    if fmt:
+        return fmt
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+@catalog_cli.command('import')
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(list(FORMATS)), help='Default: from the file extension.')
+@click.option('--batch-size', default=BATCH_SIZE, show_default=True)
+@click.option('--skip-existing', is_flag=True, help='Only add new products, leave existing ones alone.')
+def import_command(path, fmt, batch_size, skip_existing):
+    """Import products from a CSV or JSONL file ("-" for stdin)."""
+    fmt = guess_format(path, fmt)
+    stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+
+    def progress(stats):
+        click.echo('\r' + stats.summary(), nl=False, err=True)
+
+    try:
+        stats = import_items(read_rows(stream, fmt), batch_size,
+                             update_existing=not skip_existing, progress=progress)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    click.echo('', err=True)
+    for error in stats.errors:
+        click.echo('  rejected ' + error, err=True)
+    if stats.rejected > len(stats.errors):
+        click.echo('  ... and %d more' % (stats.rejected - len(stats.errors)), err=True)
+
+
+@catalog_cli.command('export')
+@click.option('--format', 'fmt', type=click.Choice(list(FORMATS)), default='csv', show_default=True)
+@click.option('-o', '--output', default='-', help='File to write, default stdout.')
+@click.option('--batch-size', default=BATCH_SIZE, show_default=True)
+def export_command(fmt, output, batch_size):
+    """Export the catalogue as CSV or JSONL."""
+    out = sys.stdout if output == '-' else open(output, 'w', newline='', encoding='utf-8')
+    count, started = 0, time.perf_counter()
+    try:
+        for rows, text in _chunks(fmt, batch_size):
+            out.write(text)
+            count += rows
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    click.echo('%d rows exported in %.2fs' % (count, time.perf_counter() - started), err=True)
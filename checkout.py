@@ -0,0 +1,127 @@
+# checkout.py
+# turns a customer's cart into an order in ONE transaction with set-based SQL:
+# conditional stock decrement, bulk order lines, bulk cart delete, sales
+# rollups
+import random
+import time
+
+from sqlalchemy import text, bindparam
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import analytics
+from cache import catalog_cache
+from db_create import db, Order
+
+MAX_RETRIES = 5
+RETRY_DELAY = 0.05      # seconds, doubled on every attempt
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class OutOfStock(CheckoutError):
+    pass
+
+
+# cart lines grouped per product, at the item's current price (the price
+# copied into cart_item is only what it was when the line was added)
+# no WITH prefix on the writes: pysqlite reports no rowcount for those
+CART_LINES = """
+SELECT c.item_id AS item_id, sum(c.quantity) AS qty,
+       max(coalesce(i.current_price, c.price)) AS price
+FROM cart_item c LEFT JOIN item i ON i.id = c.item_id
+WHERE c.customer_link = :cid
+GROUP BY c.item_id
+"""
+
+CART_QTY = """
+(SELECT sum(c.quantity) FROM cart_item c
+ WHERE c.customer_link = :cid AND c.item_id = item.id)
+"""
+
+DECREMENT_STOCK = text("""
+UPDATE item
+SET remaining = remaining - """ + CART_QTY + """
+WHERE id IN :ids
+  AND remaining >= """ + CART_QTY).bindparams(bindparam('ids', expanding=True))
+
+INSERT_LINES = text("""
+INSERT INTO order_item (order_id, product_id, quantity, price)
+SELECT :oid, item_id, qty, price FROM (""" + CART_LINES + """)
+""")
+
+
+def begin_immediate():
+    # take SQLite's write lock up front so two checkouts of the same cart
+    # serialise instead of both reading it and failing at commit
+    conn = db.session.connection()
+    if conn.dialect.name == 'sqlite' and not conn.connection.in_transaction:
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def _find_order(customer_id, key):
+    return Order.query.filter_by(customer_id=customer_id, checkout_key=key).first()
+
+
+def _place_order(customer_id, key):
+    begin_immediate()
+
+    # same key already used -> double submit, hand back the first order
+    existing = _find_order(customer_id, key)
+    if existing:
+        db.session.rollback()
+        return existing, False
+
+    params = {'cid': customer_id}
+    lines = db.session.execute(
+        text(CART_LINES), params
+    ).all()
+    if not lines:
+        db.session.rollback()
+        return None, False
+    if any(item_id is None for item_id, qty, price in lines):
+        db.session.rollback()
+        raise CheckoutError('Some cart items are no longer sold')
+
+    # all-or-nothing: every product row must pass the remaining >= qty check
+    ids = [item_id for item_id, qty, price in lines]
+    updated = db.session.execute(DECREMENT_STOCK, dict(params, ids=ids)).rowcount
+    if updated != len(lines):
+        db.session.rollback()
+        raise OutOfStock('Not enough stock for some items in your cart')
+
+    order = Order(
+        customer_id=customer_id,
+        total_amount=sum(qty * price for item_id, qty, price in lines),
+        status="Order Placed",
+        checkout_key=key
+    )
+    db.session.add(order)
+    db.session.flush()
+
+    db.session.execute(INSERT_LINES, dict(params, oid=order.id))
+    analytics.record_order(order.id)
+    db.session.execute(text("DELETE FROM cart_item WHERE customer_link = :cid"), params)
+    db.session.commit()
+    # raw SQL skips the Item mapper events; cached pages show the old stock
+    catalog_cache.bump()
+    return order, True
+
+
+def place_order(customer_id, key):
+    # returns (order, placed): placed is False for an order already placed
+    # with this key, and order is None for an empty cart. retries when the
+    # database is locked by another writer
+    for attempt in range(MAX_RETRIES):
+        try:
+            return _place_order(customer_id, key)
+        except IntegrityError:
+            # lost a race on the (customer_id, checkout_key) index
+            db.session.rollback()
+            return _find_order(customer_id, key), False
+        except OperationalError as e:
+            db.session.rollback()
+            if 'locked' not in str(e) or attempt == MAX_RETRIES - 1:
+                raise
+            time.sleep(RETRY_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5))
@@ -0,0 +1,116 @@
+# db_config.py
+# SQLite tuning: WAL + pragmas on every new connection, a real connection
+# pool for threaded serving, and an optional read-only pool that read-only
+# views (catalogue, search, product pages) are routed to.
+#
+# config (all optional):
+#   SQLITE_PRAGMAS      dict merged over DEFAULT_PRAGMAS
+#   DB_POOL_SIZE        pooled connections per process (default 10)
+#   DB_MAX_OVERFLOW     extra connections under load (default 10)
+#   DB_READ_POOL        True: @read_only views use a separate query_only pool
+#   DB_READ_POOL_SIZE   size of that pool (default 10)
+from functools import wraps
+
+import sqlalchemy
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.pool import QueuePool
+
+# busy_timeout first: switching to WAL needs the write lock for a moment
+DEFAULT_PRAGMAS = {
+    'busy_timeout': 5000,           # ms to wait for a lock instead of failing
+    'journal_mode': 'WAL',          # readers no longer block the writer
+    'synchronous': 'NORMAL',        # safe with WAL, fsync only at checkpoints
+    'cache_size': -16000,           # KiB (negative) of page cache per connection
+    'mmap_size': 128 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+def is_file_sqlite(uri):
+    url = sqlalchemy.engine.make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def apply_pragmas(engine, pragmas):
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+
+
+# ---------------- READ ROUTING ----------------
+def read_only(view):
+    # queries made by this view go to the read pool (when DB_READ_POOL is on);
+    # any write attempted from it fails instead of silently taking the lock
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class RoutingSession(SignallingSession):
+    def __init__(self, db, **options):
+        self.db = db
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if (not self._flushing and has_app_context() and g.get('db_read_only')
+                and self.app.config.get('DB_READ_POOL')):
+            return self.db.get_read_engine(self.app)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class ShopSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = SQLAlchemy.create_engine(self, sa_url, engine_opts)
+        if engine.dialect.name == 'sqlite':
+            apply_pragmas(engine, self.pragmas(self.get_app()))
+        return engine
+
+    def pragmas(self, app):
+        return dict(DEFAULT_PRAGMAS, **app.config.get('SQLITE_PRAGMAS', {}))
+
+    def get_read_engine(self, app=None):
+        # same database file, own pool, connections opened query_only
+        app = self.get_app(app)
+        engine = app.extensions.get('db_read_engine')
+        if engine is None:
+            primary = self.get_engine(app)     # takes _engine_lock itself
+            with self._engine_lock:
+                engine = app.extensions.get('db_read_engine')
+                if engine is None:
+                    options = dict(app.config['SQLALCHEMY_ENGINE_OPTIONS'],
+                                   pool_size=app.config['DB_READ_POOL_SIZE'])
+                    engine = sqlalchemy.create_engine(primary.url, **options)
+                    pragmas = self.pragmas(app)
+                    pragmas.pop('journal_mode', None)   # set by the writer pool
+                    apply_pragmas(engine, dict(pragmas, query_only=1))
+                    app.extensions['db_read_engine'] = engine
+        return engine
+
+
+def init_db_config(app):
+    # call before db.init_app(app); only file-backed SQLite is tuned
+    app.config.setdefault('DB_POOL_SIZE', 10)
+    app.config.setdefault('DB_MAX_OVERFLOW', 10)
+    app.config.setdefault('DB_READ_POOL', False)
+    app.config.setdefault('DB_READ_POOL_SIZE', 10)
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    if not is_file_sqlite(app.config['SQLALCHEMY_DATABASE_URI']):
+        app.config['DB_READ_POOL'] = False
+        return
+    # pysqlite defaults to a new connection per checkout (NullPool), which
+    # would pay for the pragmas on every request
+    options.setdefault('poolclass', QueuePool)
+    options.setdefault('pool_size', app.config['DB_POOL_SIZE'])
+    options.setdefault('max_overflow', app.config['DB_MAX_OVERFLOW'])
+    options.setdefault('pool_timeout', 10)
+    options.setdefault('connect_args', {}).setdefault('check_same_thread', False)
@@ -1,9 +1,11 @@
 # db_create.py  (updated / final)
-from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from sqlalchemy.schema import CreateColumn
+
+from db_config import ShopSQLAlchemy
 
 # single db instance used by app.py
-db = SQLAlchemy()
+db = ShopSQLAlchemy()   # SQLAlchemy + SQLite tuning, see db_config.py
 
 # ---------------- CUSTOMER ----------------
 class Customer(db.Model):
@@ -37,21 +39,39 @@ class Item(db.Model):
     image = db.Column(db.String(300))   # ← ADD THIS LINE
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # keyset pagination of the catalogue (date_added, id)
+    __table_args__ = (
+        db.Index('ix_item_date_added', 'date_added', 'id'),
+    )
+
 # ---------------- CART ITEMS ----------------
 class CartItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     customer_link = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'))
     item_name = db.Column(db.String(150), nullable=False)
     price = db.Column(db.Integer, nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
 
+    # one line per product per customer, target of the cart upserts
+    __table_args__ = (
+        db.Index('ix_cart_item_customer_item', 'customer_link', 'item_id', unique=True),
+    )
+
     
 
 # ---------------- WISHLIST ----------------
 class Wishlist(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    customer_id = db.Column(db.Integer)
-    item_id = db.Column(db.Integer)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False)
+
+    item = db.relationship('Item')
+
+    # one row per (customer, item): lookups and upserts hit this index
+    __table_args__ = (
+        db.Index('ix_wishlist_customer_item', 'customer_id', 'item_id', unique=True),
+    )
 
 # ---------------- REVIEWS ----------------
 class Review(db.Model):
@@ -62,13 +82,76 @@ class Review(db.Model):
     comment = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # newest-first review pages for one item
+    __table_args__ = (
+        db.Index('ix_review_item_id', 'item_id', 'id'),
+    )
+
+# ---------------- RATING AGGREGATES ----------------
+# one row per reviewed item, kept up to date by add_review()
+class ItemRating(db.Model):
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), primary_key=True)
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    stars_1 = db.Column(db.Integer, nullable=False, default=0)
+    stars_2 = db.Column(db.Integer, nullable=False, default=0)
+    stars_3 = db.Column(db.Integer, nullable=False, default=0)
+    stars_4 = db.Column(db.Integer, nullable=False, default=0)
+    stars_5 = db.Column(db.Integer, nullable=False, default=0)
+
+    @property
+    def average(self):
+        if not self.review_count:
+            return None
+        return self.rating_sum / self.review_count
+
+    @property
+    def histogram(self):
+        # {5: n, 4: n, ... 1: n}
+        return {star: getattr(self, 'stars_%d' % star) for star in range(5, 0, -1)}
+
+# ---------------- RECOMMENDATIONS ----------------
+# top-K "similar products" per item, written by "flask recommend build".
+# keyed (item_id, rank) without a rowid: one item's neighbours sit together
+# in the primary key b-tree and are read in one range scan
+class SimilarItem(db.Model):
+    item_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    similar_id = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Float, nullable=False)
+
+    __table_args__ = {'sqlite_with_rowid': False}
+
+# one row per build; the highest ids seen are where the next incremental
+# build starts looking for new activity
+class RecommendBuild(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    full = db.Column(db.Boolean, nullable=False, default=False)
+    items_updated = db.Column(db.Integer, nullable=False, default=0)
+    last_item_id = db.Column(db.Integer, nullable=False, default=0)
+    last_order_item_id = db.Column(db.Integer, nullable=False, default=0)
+    last_wishlist_id = db.Column(db.Integer, nullable=False, default=0)
+    last_cart_item_id = db.Column(db.Integer, nullable=False, default=0)
+    finished_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'))
     total_amount = db.Column(db.Integer, nullable=False)
     status = db.Column(db.String(30), default="Processing")  # Processing, Shipped, Out for Delivery, Delivered
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
+    checkout_key = db.Column(db.String(64))  # idempotency key from the payment page
     items = db.relationship("OrderItem", back_populates="order", cascade="all, delete")
+    customer = db.relationship("Customer")
+
+    __table_args__ = (
+        # a repeated checkout with the same key can never create a second order
+        db.Index('ix_order_checkout_key', 'customer_id', 'checkout_key', unique=True),
+        # newest-first order pages: per customer, per status, everything
+        db.Index('ix_order_customer_date', 'customer_id', 'date_created', 'id'),
+        db.Index('ix_order_status_date', 'status', 'date_created', 'id'),
+        db.Index('ix_order_date', 'date_created', 'id'),
+    )
 
     def __repr__(self):
         return f'<Order {self.id}>'
@@ -81,7 +164,114 @@ class OrderItem(db.Model):
     price = db.Column(db.Integer, nullable=False)
 
     order = db.relationship("Order", back_populates="items")
+    product = db.relationship(
+        "Item",
+        primaryjoin="foreign(OrderItem.product_id) == Item.id",
+        viewonly=True
+    )
+
+    # lines of a page of orders are loaded with one IN (...) query
+    __table_args__ = (
+        db.Index('ix_order_item_order_id', 'order_id'),
+    )
+
+# ---------------- SALES ROLLUPS ----------------
+# running totals kept by analytics.py in the same transaction as the order
+# write, so the admin numbers are read from a handful of small rows
+class DailySales(db.Model):
+    day = db.Column(db.String(10), primary_key=True)   # YYYY-MM-DD (utc)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+
+class ProductSales(db.Model):
+    item_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+    last_sold_at = db.Column(db.DateTime)
+
+    # best sellers are read straight off these indexes, top-N rows only
+    __table_args__ = (
+        db.Index('ix_product_sales_units', 'units', 'item_id'),
+        db.Index('ix_product_sales_revenue', 'revenue', 'item_id'),
+    )
+
+class StatusSales(db.Model):
+    status = db.Column(db.String(30), primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+
+class CustomerSales(db.Model):
+    customer_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+    first_order_at = db.Column(db.DateTime)
+    last_order_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_customer_sales_revenue', 'revenue', 'customer_id'),
+    )
+
+# ---------------- EMAIL QUEUE ----------------
+# outgoing mail, delivered by the worker threads in mailer.py
+class EmailJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(150), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claim_token = db.Column(db.String(32))
+    last_error = db.Column(db.String(300))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    # workers pick the oldest due pending jobs
+    __table_args__ = (
+        db.Index('ix_email_job_due', 'status', 'next_attempt_at'),
+    )
+
+
+# ---------------- SCHEMA UPGRADES ----------------
+# create_all() only creates missing tables, so databases made before a
+# column or index was added to a model get it here
+def upgrade_schema():
+    ensure_columns()
+    migrate_data()
+    ensure_indexes()
+
+
+def ensure_columns():
+    # new columns must be nullable or have a default to be added this way
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+                db.session.execute(db.text('ALTER TABLE "%s" ADD COLUMN %s' % (table.name, ddl)))
+    db.session.commit()
 
 
+def migrate_data():
+    # old wishlists could hold duplicates, which would block the unique index
+    db.session.execute(db.text(
+        "DELETE FROM wishlist WHERE id NOT IN "
+        "(SELECT min(id) FROM wishlist GROUP BY customer_id, item_id)"
+    ))
+    # cart lines used to be matched to products by name only
+    db.session.execute(db.text(
+        "UPDATE cart_item SET item_id = "
+        "(SELECT min(i.id) FROM item i WHERE i.name = cart_item.item_name) "
+        "WHERE item_id IS NULL"
+    ))
+    db.session.commit()
 
 
+def ensure_indexes():
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
@@ -0,0 +1,90 @@
+# http_cache.py
+# conditional GET for the catalogue pages. each view gets a weak ETag built
+# from the versions its content depends on (catalogue, an item's reviews,
+# the viewer's wishlist state, ...) so a matching If-None-Match is answered
+# with a 304 before anything is loaded or rendered. rendered fragments are
+# cached in the catalogue cache under the same versions.
+#
+# config (all optional):
+#   HTTP_CACHE_MAX_AGE   seconds a shared proxy may reuse an anonymous page (default 60)
+#   HTTP_CACHE_SALT      mixed into every ETag; random per process by default,
+#                        so a restart never validates a page rendered before it.
+#                        with CACHE_REDIS_URL set a fixed per-release value lets
+#                        workers share validators
+import hashlib
+import os
+from functools import wraps
+
+from flask import current_app, make_response, render_template, request, session
+from flask_login import current_user
+from markupsafe import Markup
+
+from cache import catalog_cache
+
+
+def viewer():
+    # who the page is rendered for: part of the ETag of per-user pages
+    if current_user.is_authenticated:
+        return 'u%d' % current_user.id
+    return 'anon'
+
+
+def make_etag(endpoint, parts):
+    raw = '|'.join([current_app.config['HTTP_CACHE_SALT'], endpoint] + [str(p) for p in parts])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+
+
+def set_cache_headers(response):
+    # logged-in pages may only live in the browser and must be revalidated;
+    # anonymous ones can sit in a front proxy for a while
+    if current_user.is_authenticated:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['HTTP_CACHE_MAX_AGE']
+    response.vary.add('Cookie')
+    return response
+
+
+def conditional(validator):
+    # validator(**view_args) -> list of the values the page depends on, or
+    # None to always render. pending flashed messages count too: the page
+    # that shows them must render
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+            parts = validator(*args, **kwargs)
+            if parts is None:
+                return view(*args, **kwargs)
+
+            etag = make_etag(request.endpoint, parts + [session.get('_flashes', '')])
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            return set_cache_headers(response)
+        return wrapper
+    return decorator
+
+
+# ---------------- FRAGMENTS ----------------
+def cached_fragment(name, template_name, load_context):
+    # rendered html of a partial template, cached under the catalogue version;
+    # put any other version the fragment depends on into the name.
+    # load_context() only runs on a miss
+    html = catalog_cache.get_or_load(
+        'fragment:' + name,
+        lambda: str(render_template(template_name, **load_context()))
+    )
+    return Markup(html)
+
+
+def init_http_cache(app):
+    app.config.setdefault('HTTP_CACHE_MAX_AGE', 60)
+    app.config.setdefault('HTTP_CACHE_SALT', os.urandom(8).hex())
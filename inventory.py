@@ -0,0 +1,207 @@
+# inventory.py
+# stock reservations for carts. putting something in a customer's cart
+# holds those units for RESERVE_TTL (guest carts take theirs on login);
+# availability is answered from in-memory counters (on hand - held)
+# without a db round trip. a background sweeper expires
+# abandoned holds and reconciles the counters with item.remaining.
+#
+# the counters are per process: checkout's conditional stock decrement
+# (checkout.py) stays the final guard against overselling, reservations
+# keep flash-sale clicks from piling onto it.
+#
+# config (all optional):
+#   RESERVE_ENABLED             False: carts never hold stock (default True)
+#   RESERVE_TTL                 seconds a cart line holds its units (default 900)
+#   RESERVE_SWEEP_INTERVAL      seconds between expiry sweeps (default 10)
+#   RESERVE_RECONCILE_INTERVAL  seconds between reloads of item.remaining (default 60)
+import threading
+import time
+
+from db_create import db, Item
+from cart_db import CartError
+
+RESERVE_TTL = 15 * 60
+CHUNK = 500     # ids per IN (...) when loading stock
+
+
+class NotEnoughStock(CartError):
+    pass
+
+
+def load_stock(ids):
+    # {item_id: remaining}; unknown ids are left out
+    stock = {}
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK):
+        stock.update(db.session.query(Item.id, Item.remaining)
+                     .filter(Item.id.in_(ids[start:start + CHUNK])))
+    return stock
+
+
+class Inventory:
+    def __init__(self, loader=load_stock, ttl=RESERVE_TTL):
+        self.loader = loader
+        self.ttl = ttl
+        self.on_hand = {}       # item_id -> item.remaining at the last load
+        self.reserved = {}      # item_id -> units held by carts
+        self.holds = {}         # owner -> {item_id: (qty, expires)}
+        self.sales = {}         # item_id -> checkouts counted since start
+        self.rejected = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+
+    def _track(self, ids):
+        # first touch of an item loads its stock (the db read is outside the lock)
+        missing = [i for i in ids if i not in self.on_hand]
+        if missing:
+            stock = self.loader(missing)
+            with self._lock:
+                for i in missing:
+                    self.on_hand.setdefault(i, stock.get(i, 0))
+
+    def _set_hold(self, owner, item_id, qty, expires):
+        # caller holds the lock
+        held = self.holds.setdefault(owner, {})
+        old = held.pop(item_id, (0, 0))[0]
+        if qty > 0:
+            held[item_id] = (qty, expires)
+        elif not held:
+            del self.holds[owner]
+        self.reserved[item_id] = self.reserved.get(item_id, 0) - old + qty
+        if not self.reserved[item_id]:
+            del self.reserved[item_id]
+
+    # ---- reads ----
+    def available(self, item_id):
+        self._track([item_id])
+        with self._lock:
+            return max(self.on_hand[item_id] - self.reserved.get(item_id, 0), 0)
+
+    def held(self, owner):
+        # {item_id: qty} currently held for this owner
+        with self._lock:
+            return {i: qty for i, (qty, expires) in self.holds.get(owner, {}).items()}
+
+    # ---- writes ----
+    def reserve(self, owner, item_id, qty):
+        # hold qty units for owner, replacing its earlier hold on the item and
+        # restarting the timer. False (and nothing changed) if the stock nobody
+        # else holds is short
+        return self.reserve_many(owner, {item_id: qty}) is None
+
+    def reserve_many(self, owner, wanted):
+        # {item_id: qty} in one step, all or nothing; qty 0 drops the hold.
+        # None, or the first item that is short
+        self._track([i for i, qty in wanted.items() if qty > 0])
+        with self._lock:
+            for i, qty in wanted.items():
+                own = self.holds.get(owner, {}).get(i, (0, 0))[0]
+                if qty <= own:
+                    continue
+                free = self.on_hand[i] - self.reserved.get(i, 0) + own
+                if qty > free:
+                    self.rejected += 1
+                    return i
+            expires = time.monotonic() + self.ttl
+            for i, qty in wanted.items():
+                if qty > 0 or i in self.holds.get(owner, {}):
+                    self._set_hold(owner, i, qty, expires)
+            return None
+
+    def release(self, owner, item_id=None):
+        # drop one hold, or all of the owner's; returns the released item ids
+        with self._lock:
+            ids = list(self.holds.get(owner, {})) if item_id is None else [item_id]
+            for i in ids:
+                if i in self.holds.get(owner, {}):
+                    self._set_hold(owner, i, 0, 0)
+            return ids
+
+    def sold(self, owner):
+        # after checkout: the held units left the warehouse. on hand goes down
+        # in the same step the holds are dropped, so they are never free in
+        # between; then the items are re-read (place_order decremented them)
+        with self._lock:
+            ids = list(self.holds.get(owner, {}))
+            for i in ids:
+                qty = self.holds[owner][i][0]
+                if i in self.on_hand:
+                    self.on_hand[i] = max(self.on_hand[i] - qty, 0)
+                self.sales[i] = self.sales.get(i, 0) + 1
+                self._set_hold(owner, i, 0, 0)
+        self.refresh(ids)
+
+    # ---- background ----
+    def sweep(self):
+        # expire abandoned holds; returns how many
+        now = time.monotonic()
+        with self._lock:
+            stale = [(owner, i) for owner, held in self.holds.items()
+                     for i, (qty, expires) in held.items() if expires < now]
+            for owner, i in stale:
+                self._set_hold(owner, i, 0, 0)
+            self.expired += len(stale)
+        return len(stale)
+
+    def refresh(self, ids):
+        # re-read item.remaining for these items (stock edited, order placed)
+        ids = [i for i in ids if i in self.on_hand]
+        if not ids:
+            return
+        with self._lock:
+            before = {i: self.sales.get(i, 0) for i in ids}
+        stock = self.loader(ids)
+        with self._lock:
+            for i in ids:
+                # a checkout counted while this read was in flight may not be
+                # in it; keep the decremented counter until the next refresh
+                if self.sales.get(i, 0) == before[i]:
+                    self.on_hand[i] = stock.get(i, 0)
+
+    def reconcile(self):
+        # every tracked item, in chunks: catches writes made by other processes
+        self.refresh(list(self.on_hand))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'items': len(self.on_hand),
+                'holds': sum(len(h) for h in self.holds.values()),
+                'units_held': sum(self.reserved.values()),
+                'rejected': self.rejected,
+                'expired': self.expired,
+            }
+
+
+inventory = Inventory()
+
+
+def init_inventory(app):
+    app.config.setdefault('RESERVE_ENABLED', True)
+    app.config.setdefault('RESERVE_TTL', RESERVE_TTL)
+    app.config.setdefault('RESERVE_SWEEP_INTERVAL', 10)
+    app.config.setdefault('RESERVE_RECONCILE_INTERVAL', 60)
+    inventory.ttl = app.config['RESERVE_TTL']
+
+
+def start_sweeper(app):
+    # once per process, before serving requests
+    if not app.config['RESERVE_ENABLED']:
+        return
+    interval = app.config['RESERVE_SWEEP_INTERVAL']
+    every = max(int(app.config['RESERVE_RECONCILE_INTERVAL'] // interval), 1)
+
+    def run():
+        rounds = 0
+        while True:
+            time.sleep(interval)
+            rounds += 1
+            try:
+                inventory.sweep()
+                if rounds % every == 0:
+                    with app.app_context():
+                        inventory.reconcile()
+            except Exception:
+                app.logger.exception('stock sweep failed')
+
+    threading.Thread(target=run, name='stock-sweeper', daemon=True).start()
@@ -0,0 +1,235 @@
+# mailer.py
+# background email delivery. requests only insert an EmailJob row; worker
+# threads claim due jobs in batches, send them over a reused SMTP connection
+# and retry failures with exponential backoff.
+#
+# local testing: run a debugging SMTP server, e.g.
+#     python -m aiosmtpd -n -l localhost:1025
+# and set MAIL_SERVER='localhost', MAIL_PORT=1025, MAIL_USE_TLS=False
+#
+# smtplib / email are imported inside the methods that send: only the worker
+# threads need them, web requests and CLI commands never do
+import threading
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from sqlalchemy import text, bindparam
+
+from db_create import db, EmailJob
+
+BATCH_SIZE = 20
+MAX_ATTEMPTS = 5
+RETRY_BASE = 30         # seconds, doubled per failed attempt
+LEASE = 300             # a claimed job is retried if not finished by then
+POLL_INTERVAL = 2.0
+IDLE_CLOSE = 60         # close the SMTP connection after this long idle
+
+# claim: pending jobs that are due, or "sending" ones whose lease ran out
+CLAIM = text("""
+UPDATE email_job
+SET status = 'sending', claim_token = :token, next_attempt_at = :lease
+WHERE id IN (
+    SELECT id FROM email_job
+    WHERE status IN ('pending', 'sending') AND next_attempt_at <= :now
+    ORDER BY next_attempt_at, id
+    LIMIT :limit
+)
+""")
+
+MARK_SENT = text("""
+UPDATE email_job SET status = 'sent', sent_at = :now, attempts = attempts + 1,
+    claim_token = NULL, last_error = NULL
+WHERE id IN :ids
+""").bindparams(bindparam('ids', expanding=True))
+
+MARK_FAILED = text("""
+UPDATE email_job SET status = :status, attempts = attempts + 1,
+    next_attempt_at = :retry_at, claim_token = NULL, last_error = :error
+WHERE id = :id
+""")
+
+
+# ---------------- METRICS ----------------
+class MailStats:
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.batches = 0
+        self.connections = 0
+        self.send_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'sent': self.sent,
+                'failed': self.failed,
+                'retried': self.retried,
+                'batches': self.batches,
+                'smtp_connections': self.connections,
+                'avg_send_ms': round(1000 * self.send_seconds / self.sent, 2) if self.sent else None,
+            }
+
+
+# ---------------- MAILER ----------------
+class Mailer:
+    def __init__(self):
+        self.config = {}
+        self.stats = MailStats()
+        self._wakeup = threading.Event()
+        self._threads = []
+
+    def enqueue(self, recipient, subject, body):
+        # joins the caller's transaction; call wake() after the commit
+        job = EmailJob(recipient=recipient, subject=subject, body=body)
+        db.session.add(job)
+        return job
+
+    def wake(self):
+        self._wakeup.set()
+
+    def queue_depth(self):
+        return EmailJob.query.filter(EmailJob.status.in_(('pending', 'sending'))).count()
+
+    def metrics(self):
+        return dict(self.stats.snapshot(), queued=self.queue_depth(), workers=len(self._threads))
+
+    # ---- claiming ----
+    def claim(self, limit=BATCH_SIZE):
+        now = datetime.utcnow()
+        token = uuid4().hex
+        db.session.execute(CLAIM, {
+            'token': token, 'now': now, 'lease': now + timedelta(seconds=LEASE), 'limit': limit
+        })
+        db.session.commit()
+        return EmailJob.query.filter_by(claim_token=token).order_by(EmailJob.id).all()
+
+    # ---- SMTP ----
+    def connect(self):
+        import smtplib
+        cfg = self.config
+        server = smtplib.SMTP(cfg['MAIL_SERVER'], cfg['MAIL_PORT'], timeout=cfg['MAIL_TIMEOUT'])
+        if cfg['MAIL_USE_TLS']:
+            server.starttls()
+        if cfg['MAIL_USERNAME']:
+            server.login(cfg['MAIL_USERNAME'], cfg['MAIL_PASSWORD'])
+        self.stats.add(connections=1)
+        return server
+
+    def message(self, job):
+        from email.message import EmailMessage
+        msg = EmailMessage()
+        msg['From'] = self.config['MAIL_SENDER']
+        msg['To'] = job.recipient
+        msg['Subject'] = job.subject
+        msg.set_content(job.body)
+        return msg
+
+    def send_batch(self, server, jobs):
+        # returns the (possibly new) connection; results saved in one commit
+        import smtplib
+        sent, failures = [], []
+        for job in jobs:
+            started = time.perf_counter()
+            try:
+                msg = self.message(job)
+            except (ValueError, TypeError) as e:
+                # bad address / header: retrying can't fix it
+                failures.append((job, e, True))
+                continue
+            try:
+                if server is None:
+                    server = self.connect()
+                server.send_message(msg)
+                sent.append(job.id)
+                self.stats.add(send_seconds=time.perf_counter() - started)
+            except (smtplib.SMTPException, OSError) as e:
+                failures.append((job, e, False))
+                if server is not None and not isinstance(e, smtplib.SMTPRecipientsRefused):
+                    close_quietly(server)
+                    server = None
+
+        now = datetime.utcnow()
+        if sent:
+            db.session.execute(MARK_SENT, {'now': now, 'ids': sent})
+        for job, error, permanent in failures:
+            attempts = job.attempts + 1
+            final = permanent or attempts >= MAX_ATTEMPTS
+            db.session.execute(MARK_FAILED, {
+                'id': job.id,
+                'status': 'failed' if final else 'pending',
+                'retry_at': now + timedelta(seconds=RETRY_BASE * 2 ** (attempts - 1)),
+                'error': str(error)[:300],
+            })
+            if final:
+                self.stats.add(failed=1)
+            else:
+                self.stats.add(retried=1)
+        db.session.commit()
+        self.stats.add(sent=len(sent), batches=1)
+        return server
+
+    # ---- workers ----
+    def run_worker(self, app):
+        server, last_used = None, time.monotonic()
+        with app.app_context():
+            while True:
+                try:
+                    jobs = self.claim()
+                    if jobs:
+                        server = self.send_batch(server, jobs)
+                        last_used = time.monotonic()
+                        continue
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception('mail worker error')
+                finally:
+                    db.session.remove()
+
+                if server is not None and time.monotonic() - last_used > IDLE_CLOSE:
+                    close_quietly(server)
+                    server = None
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def start(self, app, workers):
+        for n in range(workers):
+            t = threading.Thread(target=self.run_worker, args=(app,), name='mailer-%d' % n, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+
+def close_quietly(server):
+    import smtplib
+    try:
+        server.quit()
+    except (smtplib.SMTPException, OSError):
+        pass
+
+
+mailer = Mailer()
+
+
+def init_mail(app, sender='', password=''):
+    app.config.setdefault('MAIL_SERVER', 'smtp.gmail.com')
+    app.config.setdefault('MAIL_PORT', 587)
+    app.config.setdefault('MAIL_USE_TLS', True)
+    app.config.setdefault('MAIL_USERNAME', sender)
+    app.config.setdefault('MAIL_PASSWORD', password)
+    app.config.setdefault('MAIL_SENDER', sender)
+    app.config.setdefault('MAIL_TIMEOUT', 10)
+    app.config.setdefault('MAIL_WORKERS', 1)
+    mailer.config = app.config
+
+
+def start_mail_workers(app):
+    # after create_all(), the workers need the email_job table
+    if app.config['MAIL_WORKERS'] > 0:
+        mailer.start(app, app.config['MAIL_WORKERS'])
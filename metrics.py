@@ -0,0 +1,211 @@
+# metrics.py
+# per-request instrumentation: latency, SQL statement count and SQL time per
+# route, N+1 detection (same statement shape over and over in one request),
+# a slow-request log with the query breakdown, and Prometheus text output.
+#
+# config (all optional):
+#   METRICS_SLOW_MS      log requests slower than this (default 500)
+#   METRICS_N_PLUS_ONE   flag a statement shape run more often than this (default 10)
+#   METRICS_PROFILE      True: ?_profile=1 logs a cProfile summary of the request
+import cProfile
+import io
+import pstats
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+# literals and expanded IN (...) lists collapse so repeats share one shape
+SHAPE_RES = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\?(?:\s*,\s*\?)+'), '?'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def statement_shape(statement):
+    for pattern, repl in SHAPE_RES:
+        statement = pattern.sub(repl, statement)
+    return statement.strip()
+
+
+# ---------------- COLLECTORS ----------------
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+
+class RequestStats:
+    # what one request did, kept on flask.g
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.shapes = Counter()
+        self.shape_seconds = defaultdict(float)
+        self.status = None
+
+    def record(self, statement, seconds):
+        shape = statement_shape(statement)
+        self.queries += 1
+        self.sql_seconds += seconds
+        self.shapes[shape] += 1
+        self.shape_seconds[shape] += seconds
+
+    def breakdown(self, limit=5):
+        # most expensive statement shapes first
+        top = sorted(self.shape_seconds.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+        return ['%4dx %8.1f ms  %s' % (self.shapes[shape], seconds * 1000, shape[:160])
+                for shape, seconds in top]
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.config = {}
+        self.requests = Counter()                      # (endpoint, method, status)
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+        self.sql_time = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.n_plus_one = Counter()
+        self.slow = Counter()
+        self._lock = threading.Lock()
+
+    def finish(self, stats, endpoint, method, logger):
+        elapsed = time.perf_counter() - stats.started
+        repeated = [(shape, n) for shape, n in stats.shapes.items()
+                    if n > self.config['METRICS_N_PLUS_ONE']]
+        slow = elapsed * 1000 > self.config['METRICS_SLOW_MS']
+        with self._lock:
+            self.requests[endpoint, method, stats.status or 500] += 1
+            self.latency[endpoint].observe(elapsed)
+            self.queries[endpoint].observe(stats.queries)
+            self.sql_time[endpoint].observe(stats.sql_seconds)
+            if repeated:
+                self.n_plus_one[endpoint] += 1
+            if slow:
+                self.slow[endpoint] += 1
+
+        for shape, n in repeated:
+            logger.warning('possible N+1 in %s: %d x %s', endpoint, n, shape[:160])
+        if slow:
+            logger.warning('slow request %s %s: %.0f ms, %d queries, %.1f ms SQL\n%s',
+                           method, request.full_path.rstrip('?'), elapsed * 1000,
+                           stats.queries, stats.sql_seconds * 1000, '\n'.join(stats.breakdown()))
+
+    # ---- prometheus text format ----
+    def render(self, extra=()):
+        # extra: (name, type, help, value) for gauges/counters owned elsewhere
+        lines = []
+
+        def header(name, kind, text):
+            lines.append('# HELP %s %s' % (name, text))
+            lines.append('# TYPE %s %s' % (name, kind))
+
+        def histogram(name, text, series):
+            header(name, 'histogram', text)
+            for endpoint, h in sorted(series.items()):
+                for bound, count in zip(h.buckets, h.counts):
+                    lines.append('%s_bucket{endpoint="%s",le="%s"} %d' % (name, endpoint, bound, count))
+                lines.append('%s_bucket{endpoint="%s",le="+Inf"} %d' % (name, endpoint, h.total))
+                lines.append('%s_sum{endpoint="%s"} %.6f' % (name, endpoint, h.sum))
+                lines.append('%s_count{endpoint="%s"} %d' % (name, endpoint, h.total))
+
+        def counter(name, text, series):
+            header(name, 'counter', text)
+            for endpoint, value in sorted(series.items()):
+                lines.append('%s{endpoint="%s"} %d' % (name, endpoint, value))
+
+        with self._lock:
+            header('http_requests_total', 'counter', 'Requests handled.')
+            for (endpoint, method, status), value in sorted(self.requests.items()):
+                lines.append('http_requests_total{endpoint="%s",method="%s",status="%s"} %d'
+                             % (endpoint, method, status, value))
+            histogram('http_request_duration_seconds', 'Request latency.', self.latency)
+            histogram('http_request_sql_queries', 'SQL statements per request.', self.queries)
+            histogram('http_request_sql_seconds', 'Time spent in SQL per request.', self.sql_time)
+            counter('http_n_plus_one_total', 'Requests repeating one statement shape too often.',
+                    self.n_plus_one)
+            counter('http_slow_requests_total', 'Requests slower than METRICS_SLOW_MS.', self.slow)
+
+        for name, kind, text, value in extra:
+            if value is None:
+                continue
+            header(name, kind, text)
+            lines.append('%s %s' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
+
+
+# ---------------- HOOKS ----------------
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    # background threads (mail, cart flusher) have no request to charge
+    if has_request_context() and 'request_stats' in g:
+        g.request_stats.record(statement, time.perf_counter() - started)
+
+
+def watch_engines():
+    # on the Engine class, so the writer and read pools are both covered
+    if event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        return
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def init_metrics(app):
+    app.config.setdefault('METRICS_SLOW_MS', 500)
+    app.config.setdefault('METRICS_N_PLUS_ONE', 10)
+    app.config.setdefault('METRICS_PROFILE', False)
+    request_metrics.config = app.config
+    watch_engines()
+
+    @app.before_request
+    def start_request():
+        g.request_stats = RequestStats()
+        if app.config['METRICS_PROFILE'] and request.args.get('_profile'):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def record_status(response):
+        if 'request_stats' in g:
+            g.request_stats.status = response.status_code
+        return response
+
+    # teardown, not after_request: streamed templates render after the latter
+    @app.teardown_request
+    def finish_request(exc):
+        stats = g.pop('request_stats', None)
+        if stats is None:
+            return
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(25)
+            app.logger.warning('profile of %s\n%s', request.path, out.getvalue())
+        request_metrics.finish(stats, request.endpoint or 'unmatched', request.method, app.logger)
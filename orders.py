@@ -0,0 +1,65 @@
+# orders.py
+# order history pages: keyset pagination, filters and eager-loaded lines,
+# so a page costs the same few queries however long the history is
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import selectinload, joinedload
+
+from db_create import Order, OrderItem
+
+PAGE_SIZE = 20
+STATUSES = ["Order Placed", "Processing", "Shipped", "Out for Delivery", "Delivered"]
+
+
+# cursor = "<date_created iso>_<id>" of the last order on the previous page
+def encode_cursor(order):
+    return '%s_%d' % (order.date_created.isoformat(), order.id)
+
+
+def decode_cursor(cursor):
+    try:
+        stamp, order_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(stamp), int(order_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def parse_day(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+
+def orders_page(customer_id=None, status=None, date_from=None, date_to=None,
+                cursor=None, limit=PAGE_SIZE):
+    # returns ([orders with .items/.items[].product/.customer loaded], next_cursor)
+    # 3 queries: orders (+ customer join), their lines, the lines' products
+    q = Order.query.options(
+        joinedload(Order.customer),
+        selectinload(Order.items).selectinload(OrderItem.product),
+    )
+    if customer_id is not None:
+        q = q.filter(Order.customer_id == customer_id)
+    if status:
+        q = q.filter(Order.status == status)
+    if date_from:
+        q = q.filter(Order.date_created >= date_from)
+    if date_to:
+        q = q.filter(Order.date_created < date_to + timedelta(days=1))
+
+    after = decode_cursor(cursor) if cursor else None
+    if after:
+        stamp, order_id = after
+        q = q.filter(or_(
+            Order.date_created < stamp,
+            and_(Order.date_created == stamp, Order.id < order_id)
+        ))
+
+    orders = q.order_by(Order.date_created.desc(), Order.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor(orders[-1])
+    return orders, next_cursor
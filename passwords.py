@@ -0,0 +1,244 @@
+# passwords.py
+# password hashing off the request threads. pbkdf2 is deliberately slow:
+# a burst of logins (a flash sale opening) would otherwise keep every core
+# busy hashing while catalogue and cart requests wait. hashes can run in a
+# small process pool (AUTH_HASH_WORKERS); either way a semaphore bounds the
+# hashes in flight, and when it is full a login is turned away at once
+# instead of adding to the backlog.
+# token buckets per email and per client address cap how many hashes one
+# attacker (or one impatient user) can ask for.
+#
+# hashes made with older parameters are replaced on the next good login.
+#
+# config (all optional):
+#   AUTH_HASH_METHOD        werkzeug method, e.g. 'pbkdf2:sha256:600000' (default pbkdf2:sha256:260000)
+#   AUTH_SALT_LENGTH        salt characters (default 16)
+#   AUTH_HASH_WORKERS       hashing processes; 0 hashes on the request thread (default 0)
+#   AUTH_HASH_QUEUE         hashes running or waiting per process (default 4 per worker)
+#   AUTH_HASH_TIMEOUT       seconds a request waits for its hash (default 10)
+#   AUTH_LOGIN_BURST        login attempts per email before throttling (default 5)
+#   AUTH_LOGIN_RATE         attempts per email per minute after that (default 6)
+#   AUTH_IP_BURST           login / signup attempts per client address (default 30)
+#   AUTH_IP_RATE            attempts per address per minute after that (default 60)
+import multiprocessing
+import sys
+import threading
+import time
+import types
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+HASH_METHOD = 'pbkdf2:sha256:%d' % DEFAULT_PBKDF2_ITERATIONS
+SALT_LENGTH = 16
+
+
+class AuthError(Exception):
+    status = 503
+
+
+class HashingBusy(AuthError):
+    pass
+
+
+class RateLimited(AuthError):
+    status = 429
+
+    def __init__(self, retry_after):
+        AuthError.__init__(self, 'Too many attempts, please try again in %d seconds' % retry_after)
+        self.retry_after = retry_after
+
+
+# ---------------- HASHING ----------------
+@contextmanager
+def bare_main():
+    # spawned workers re-import the parent's __main__ first: an unguarded
+    # script would build the whole app again in every worker (and break the
+    # pool). they need nothing but werkzeug, so they are started without it
+    main = sys.modules['__main__']
+    sys.modules['__main__'] = types.ModuleType('__main__')
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main
+
+
+def full_method(method):
+    # werkzeug fills in the pbkdf2 iterations when they are left out
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        return '%s:%d' % (method, DEFAULT_PBKDF2_ITERATIONS)
+    return method
+
+
+class Hasher:
+    def __init__(self):
+        self.method = HASH_METHOD
+        self.salt_length = SALT_LENGTH
+        self.workers = 0
+        self.timeout = 10
+        self.slots = threading.BoundedSemaphore(4)
+        self.hashes = 0
+        self.busy = 0
+        self.seconds = 0.0
+        self._pool = None
+        self._lock = threading.Lock()
+        self._spawn_lock = threading.Lock()
+
+    def pool(self):
+        # started on first use. spawn, not fork: the parent has threads
+        # (mail workers, cart flusher) that a forked child would inherit mid-lock
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(
+                        self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def _reset(self):
+        # a worker died: the next call starts a fresh pool
+        with self._lock:
+            self._pool = None
+
+    def _run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            with self._lock:
+                self.busy += 1
+            raise HashingBusy('Too many people are signing in right now, please try again')
+        started = time.perf_counter()
+        try:
+            if not self.workers:
+                try:
+                    return fn(*args)
+                finally:
+                    self.slots.release()
+            try:
+                # the pool starts its processes on demand, inside submit()
+                with self._spawn_lock, bare_main():
+                    future = self.pool().submit(fn, *args)
+            except BrokenProcessPool:
+                self.slots.release()
+                self._reset()
+                raise HashingBusy('Signing in is unavailable, please try again')
+            # the slot stays taken until the pool is done with the job, even
+            # when this request stops waiting for it
+            future.add_done_callback(lambda f: self.slots.release())
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeout:
+                raise HashingBusy('Signing in is taking too long, please try again')
+            except BrokenProcessPool:
+                self._reset()
+                raise HashingBusy('Signing in is unavailable, please try again')
+        finally:
+            with self._lock:
+                self.hashes += 1
+                self.seconds += time.perf_counter() - started
+
+    def generate(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        # made with another method / iteration count / salt length
+        if pwhash.count('$') < 2:
+            return True
+        method, salt, hashval = pwhash.split('$', 2)
+        return method != full_method(self.method) or len(salt) != self.salt_length
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'hashes': self.hashes,
+            'busy': self.busy,
+            'seconds': round(self.seconds, 3),
+        }
+
+
+hasher = Hasher()
+
+
+# ---------------- RATE LIMITING ----------------
+class TokenBucket:
+    # per key: up to `burst` tokens, refilled at `rate` per second; an
+    # attempt takes one. full buckets are forgotten when the map grows
+    MAX_KEYS = 100000
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.limited = 0
+        self._buckets = {}      # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        # 0 if allowed, else seconds until the next token
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                self.limited += 1
+                return (1 - tokens) / self.rate
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.MAX_KEYS:
+                self._prune(now)
+            return 0
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def _prune(self, now):
+        # caller holds the lock
+        full = [key for key, (tokens, updated) in self._buckets.items()
+                if tokens + (now - updated) * self.rate >= self.burst]
+        for key in full:
+            del self._buckets[key]
+
+
+email_limiter = TokenBucket(rate=6 / 60.0, burst=5)
+ip_limiter = TokenBucket(rate=60 / 60.0, burst=30)
+
+
+def throttle(email=None, address=None):
+    # one token from each bucket that applies; RateLimited if one is empty
+    wait = max(email_limiter.take(email.strip().lower()) if email else 0,
+               ip_limiter.take(address) if address else 0)
+    if wait:
+        raise RateLimited(int(wait) + 1)
+
+
+def login_succeeded(email):
+    email_limiter.reset(email.strip().lower())
+
+
+def stats():
+    return dict(hasher.stats(), limited=email_limiter.limited + ip_limiter.limited)
+
+
+def init_passwords(app):
+    config = app.config
+    config.setdefault('AUTH_HASH_METHOD', HASH_METHOD)
+    config.setdefault('AUTH_SALT_LENGTH', SALT_LENGTH)
+    config.setdefault('AUTH_HASH_WORKERS', 0)
+    config.setdefault('AUTH_HASH_QUEUE', 4 * max(config['AUTH_HASH_WORKERS'], 1))
+    config.setdefault('AUTH_HASH_TIMEOUT', 10)
+    config.setdefault('AUTH_LOGIN_BURST', 5)
+    config.setdefault('AUTH_LOGIN_RATE', 6)
+    config.setdefault('AUTH_IP_BURST', 30)
+    config.setdefault('AUTH_IP_RATE', 60)
+
+    hasher.method = config['AUTH_HASH_METHOD']
+    hasher.salt_length = config['AUTH_SALT_LENGTH']
+    hasher.workers = config['AUTH_HASH_WORKERS']
+    hasher.timeout = config['AUTH_HASH_TIMEOUT']
+    hasher.slots = threading.BoundedSemaphore(config['AUTH_HASH_QUEUE'])
+    for limiter, rate, burst in ((email_limiter, 'AUTH_LOGIN_RATE', 'AUTH_LOGIN_BURST'),
+                                 (ip_limiter, 'AUTH_IP_RATE', 'AUTH_IP_BURST')):
+        limiter.rate = config[rate] / 60.0
+        limiter.burst = config[burst]
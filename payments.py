@@ -0,0 +1,240 @@
+# payments.py
+# payment gateways behind one small interface, so a view never holds its
+# worker thread on an unbounded network call:
+#   - StripeGateway: Stripe's REST API over a pooled keep-alive session with
+#     connect/read timeouts; retried only under an idempotency key
+#   - LocalGateway: in-process stand-in with a configurable latency and
+#     failure rate, for development and offline load tests
+# a semaphore caps gateway calls in flight per process: when the gateway is
+# slow, extra checkouts are turned away quickly instead of piling up threads.
+#
+# config (all optional):
+#   PAYMENT_PROVIDER            'stripe' or 'local' (default: stripe if STRIPE_API_KEY is set)
+#   PAYMENT_CURRENCY            default 'inr'
+#   PAYMENT_CONNECT_TIMEOUT     seconds (default 3)
+#   PAYMENT_READ_TIMEOUT        seconds (default 10)
+#   PAYMENT_RETRIES             extra attempts on connection errors / 429 / 5xx (default 2)
+#   PAYMENT_POOL_SIZE           keep-alive connections to the gateway (default 10)
+#   PAYMENT_MAX_CONCURRENT      gateway calls in flight per process (default: the pool size)
+#   PAYMENT_QUEUE_TIMEOUT       seconds to wait for a free slot (default 0.5)
+#   PAYMENT_LOCAL_LATENCY_MS    LocalGateway: simulated round trip (default 0)
+#   PAYMENT_LOCAL_FAILURE_RATE  LocalGateway: share of calls that fail (default 0)
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+from uuid import uuid4
+
+from sqlalchemy import text
+
+from checkout import CART_LINES
+from db_create import db
+
+RETRY_DELAY = 0.2       # seconds, doubled on every attempt
+
+
+class PaymentError(Exception):
+    status = 502
+
+
+class PaymentDeclined(PaymentError):
+    status = 402
+
+
+class GatewayTimeout(PaymentError):
+    status = 504
+
+
+class GatewayBusy(PaymentError):
+    status = 503
+
+
+class Intent:
+    def __init__(self, id, client_secret, amount, currency, provider):
+        self.id = id
+        self.client_secret = client_secret
+        self.amount = amount
+        self.currency = currency
+        self.provider = provider
+
+    def to_json(self):
+        return {'clientSecret': self.client_secret, 'amount': self.amount,
+                'currency': self.currency, 'provider': self.provider}
+
+
+# ---------------- GATEWAYS ----------------
+class StripeGateway:
+    name = 'stripe'
+    URL = 'https://api.stripe.com/v1/payment_intents'
+
+    def __init__(self, api_key, connect_timeout=3, read_timeout=10, retries=2, pool_size=10):
+        self.api_key = api_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.pool_size = pool_size
+        self._session = None
+        self._lock = threading.Lock()
+
+    def session(self):
+        # one keep-alive session per process, built on first use: requests
+        # is only imported once a payment is actually started
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+                    session.auth = (self.api_key, '')
+                    self._session = session
+        return self._session
+
+    def create_intent(self, amount, currency, key, metadata):
+        import requests
+        data = {'amount': amount, 'currency': currency, 'payment_method_types[]': 'card'}
+        data.update(('metadata[%s]' % name, value) for name, value in metadata.items())
+        # same key -> stripe hands back the first intent, so a retry can never
+        # create a second one. a read timeout is not retried here: the thread
+        # has waited long enough, the browser may try again with the same key
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session().post(self.URL, data=data, timeout=self.timeout,
+                                               headers={'Idempotency-Key': key})
+            except requests.ReadTimeout:
+                raise GatewayTimeout('Payment gateway timed out')
+            except requests.ConnectionError:
+                error = PaymentError('Payment gateway unreachable')
+            else:
+                if response.status_code < 500 and response.status_code != 429:
+                    break
+                error = PaymentError('Payment gateway error (%d)' % response.status_code)
+            if attempt == self.retries:
+                raise error
+            time.sleep(RETRY_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+        body = response.json()
+        if response.status_code != 200:
+            raise PaymentDeclined(body.get('error', {}).get('message', 'Payment was declined'))
+        return Intent(body['id'], body['client_secret'], body['amount'], body['currency'], self.name)
+
+
+class LocalGateway:
+    name = 'local'
+    MAX_INTENTS = 10000
+
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._intents = OrderedDict()     # idempotency key -> Intent, like the real one
+        self._lock = threading.Lock()
+
+    def create_intent(self, amount, currency, key, metadata):
+        with self._lock:
+            intent = self._intents.get(key)
+        if intent is None:
+            if self.latency:
+                time.sleep(self.latency)
+            if self.failure_rate and random.random() < self.failure_rate:
+                raise PaymentError('Payment gateway error (simulated)')
+            ref = uuid4().hex[:24]
+            intent = Intent('pi_local_' + ref, 'pi_local_%s_secret_%s' % (ref, uuid4().hex[:16]),
+                            amount, currency, self.name)
+            with self._lock:
+                intent = self._intents.setdefault(key, intent)
+                while len(self._intents) > self.MAX_INTENTS:
+                    self._intents.popitem(last=False)
+        if intent.amount != amount:
+            raise PaymentDeclined('Idempotency key reused with a different amount')
+        return intent
+
+
+# ---------------- PAYMENTS ----------------
+class Payments:
+    def __init__(self):
+        self.gateway = LocalGateway()
+        self.local = self.gateway       # the UPI / GPay demo methods always use it
+        self.currency = 'inr'
+        self.queue_timeout = 0.5
+        self.slots = threading.BoundedSemaphore(10)
+        self.requests = 0
+        self.errors = 0
+        self.busy = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def create_intent(self, amount, key, metadata=None, gateway=None):
+        gateway = gateway or self.gateway
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.busy += 1
+            raise GatewayBusy('Payment gateway is busy, please try again')
+        started = time.perf_counter()
+        failed = True
+        try:
+            intent = gateway.create_intent(amount, self.currency, key, metadata or {})
+            failed = False
+            return intent
+        finally:
+            self.slots.release()
+            with self._lock:
+                self.requests += 1
+                self.errors += failed
+                self.seconds += time.perf_counter() - started
+
+    def stats(self):
+        return {
+            'provider': self.gateway.name,
+            'requests': self.requests,
+            'errors': self.errors,
+            'busy': self.busy,
+            'seconds': round(self.seconds, 3),
+        }
+
+
+payments = Payments()
+
+
+# ---------------- AMOUNTS / KEYS ----------------
+def cart_amount(customer_id):
+    # (amount in paise, fingerprint of the cart lines) from cart_item, the
+    # same grouped lines the order will be placed from
+    lines = db.session.execute(text(CART_LINES), {'cid': customer_id}).all()
+    amount = sum(qty * price for item_id, qty, price in lines) * 100
+    fingerprint = hashlib.sha1(repr(sorted(tuple(line) for line in lines)).encode()).hexdigest()[:16]
+    return amount, fingerprint
+
+
+def payment_key(customer_id, checkout_key, method, fingerprint):
+    # one intent per checkout attempt, method and cart contents: a double
+    # click reuses it, a changed cart gets a new one with the new amount
+    return 'pay-%d-%s-%s-%s' % (customer_id, checkout_key, method, fingerprint)
+
+
+def init_payments(app):
+    config = app.config
+    config.setdefault('PAYMENT_PROVIDER', 'stripe' if config.get('STRIPE_API_KEY') else 'local')
+    config.setdefault('PAYMENT_CURRENCY', 'inr')
+    config.setdefault('PAYMENT_CONNECT_TIMEOUT', 3)
+    config.setdefault('PAYMENT_READ_TIMEOUT', 10)
+    config.setdefault('PAYMENT_RETRIES', 2)
+    config.setdefault('PAYMENT_POOL_SIZE', 10)
+    config.setdefault('PAYMENT_MAX_CONCURRENT', config['PAYMENT_POOL_SIZE'])
+    config.setdefault('PAYMENT_QUEUE_TIMEOUT', 0.5)
+    config.setdefault('PAYMENT_LOCAL_LATENCY_MS', 0)
+    config.setdefault('PAYMENT_LOCAL_FAILURE_RATE', 0.0)
+
+    payments.local = LocalGateway(latency=config['PAYMENT_LOCAL_LATENCY_MS'] / 1000.0,
+                                  failure_rate=config['PAYMENT_LOCAL_FAILURE_RATE'])
+    if config['PAYMENT_PROVIDER'] == 'stripe':
+        payments.gateway = StripeGateway(
+            config['STRIPE_API_KEY'],
+            connect_timeout=config['PAYMENT_CONNECT_TIMEOUT'],
+            read_timeout=config['PAYMENT_READ_TIMEOUT'],
+            retries=config['PAYMENT_RETRIES'],
+            pool_size=config['PAYMENT_POOL_SIZE'])
+    else:
+        payments.gateway = payments.local
+    payments.currency = config['PAYMENT_CURRENCY']
+    payments.queue_timeout = config['PAYMENT_QUEUE_TIMEOUT']
+    payments.slots = threading.BoundedSemaphore(config['PAYMENT_MAX_CONCURRENT'])
@@ -0,0 +1,30 @@
+# product_index.py
+# flash-sale name -> item id, so the flash routes skip a name lookup per click.
+# names are looked up on first use and forgotten when the catalogue version
+# changes
+from db_create import db, Item
+from cache import catalog_cache
+
+
+class ProductIndex:
+    def __init__(self):
+        self.by_name = {}
+        self.version = None
+
+    def ensure_fresh(self):
+        version = catalog_cache.version()
+        if self.version != version:
+            # a new dict replaces the old one in one step
+            self.by_name, self.version = {}, version
+
+    def id_for_name(self, name):
+        self.ensure_fresh()
+        by_name = self.by_name
+        if name not in by_name:
+            # same match as the flash seeding; lowest id wins
+            row = db.session.query(Item.id).filter(Item.name == name).order_by(Item.id).first()
+            by_name[name] = row.id if row else None
+        return by_name[name]
+
+
+product_index = ProductIndex()
@@ -0,0 +1,85 @@
+# ratings.py
+# precomputed review aggregates + keyset-paginated review lists
+from sqlalchemy.dialects.sqlite import insert
+
+from db_create import db, Customer, Review, ItemRating
+
+REVIEWS_PER_PAGE = 10
+STAR_COLUMNS = ['stars_%d' % star for star in range(1, 6)]
+
+
+def record_review(item_id, rating):
+    # bump the aggregate row in the same transaction as the review insert
+    # (caller commits). one upsert, no read of existing reviews
+    star = 'stars_%d' % rating
+    values = {col: 0 for col in STAR_COLUMNS}
+    values.update(item_id=item_id, review_count=1, rating_sum=rating)
+    values[star] = 1
+
+    stmt = insert(ItemRating).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['item_id'],
+        set_={
+            'review_count': ItemRating.review_count + 1,
+            'rating_sum': ItemRating.rating_sum + rating,
+            star: getattr(ItemRating, star) + 1,
+        }
+    )
+    db.session.execute(stmt)
+
+
+def add_review(customer_id, item_id, rating, comment):
+    # the review and its aggregate bump, for one write-queue batch
+    db.session.add(Review(customer_id=customer_id, item_id=item_id, rating=rating, comment=comment))
+    record_review(item_id, rating)
+
+
+def get_summary(item_id):
+    # ItemRating or None if the item has no reviews yet
+    return ItemRating.query.get(item_id)
+
+
+def reviews_page(item_id, cursor=None, limit=REVIEWS_PER_PAGE):
+    # newest first, keyset on review.id (served by ix_review_item_id)
+    # returns ([(review, username), ...], next_cursor)
+    q = db.session.query(Review, Customer.username) \
+        .join(Customer, Customer.id == Review.customer_id) \
+        .filter(Review.item_id == item_id)
+    if cursor:
+        q = q.filter(Review.id < cursor)
+    rows = q.order_by(Review.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1][0].id
+    return rows, next_cursor
+
+
+def rebuild():
+    # recompute every aggregate from the review table in one grouped query
+    db.session.query(ItemRating).delete()
+    db.session.execute(db.text(
+        "INSERT INTO item_rating "
+        "(item_id, review_count, rating_sum, stars_1, stars_2, stars_3, stars_4, stars_5) "
+        "SELECT item_id, count(*), sum(rating), "
+        "sum(rating = 1), sum(rating = 2), sum(rating = 3), sum(rating = 4), sum(rating = 5) "
+        "FROM review GROUP BY item_id"
+    ))
+    db.session.commit()
+
+
+def backfill():
+    # databases created before item_rating existed
+    if ItemRating.query.first() is None and Review.query.first() is not None:
+        rebuild()
+
+
+def review_to_json(review, username):
+    return {
+        'id': review.id,
+        'rating': review.rating,
+        'comment': review.comment,
+        'username': username,
+        'created_at': review.created_at.isoformat() if review.created_at else None,
+    }
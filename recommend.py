@@ -0,0 +1,239 @@
+# recommend.py
+# "similar products" for the product page. computed offline: item-to-item
+# co-occurrence (customers who ordered / saved / carted both) blended with
+# product-name similarity, as sparse matrix products (numpy + scipy), and
+# stored as a top-K table (similar_item) read with one primary-key lookup.
+#
+#   flask recommend build            # items with new activity since the last build
+#   flask recommend build --full     # everything (also forgets removed wishlists etc.)
+#   flask recommend show 42          # neighbours of one item
+#
+# only the build needs numpy and scipy; serving is plain SQL.
+#
+# config (all optional):
+#   RECOMMEND_TOP_K         neighbours kept per item (default 12)
+#   RECOMMEND_NAME_WEIGHT   share of the score from name similarity (default 0.3)
+import math
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import insert
+
+from cache import catalog_cache
+from db_create import db, Item, Order, OrderItem, Wishlist, CartItem, SimilarItem, RecommendBuild
+from search_index import tokenize
+
+TOP_K = 12
+NAME_WEIGHT = 0.3
+# how much one signal says about a customer's taste
+WEIGHTS = {'order': 3.0, 'wishlist': 2.0, 'cart': 1.0}
+# name tokens on more than this share of items ("the", "pro") say nothing
+MAX_TOKEN_SHARE = 0.1
+BLOCK = 512     # items scored per matrix product, bounds memory
+
+
+# ---------------- SERVING ----------------
+def similar_items(item_id, limit=6):
+    return db.session.query(Item) \
+        .join(SimilarItem, SimilarItem.similar_id == Item.id) \
+        .filter(SimilarItem.item_id == item_id) \
+        .order_by(SimilarItem.rank) \
+        .limit(limit).all()
+
+
+# ---------------- MATRICES ----------------
+def _watermarks():
+    # highest ids now; read before the data so nothing falls between builds
+    def top(column):
+        return db.session.query(db.func.max(column)).scalar() or 0
+    return {
+        'last_item_id': top(Item.id),
+        'last_order_item_id': top(OrderItem.id),
+        'last_wishlist_id': top(Wishlist.id),
+        'last_cart_item_id': top(CartItem.id),
+    }
+
+
+def _signals(since=None):
+    # (customer_id, item_id, weight) rows; since: a RecommendBuild, to get
+    # only the activity after it
+    orders = db.session.query(Order.customer_id, OrderItem.product_id) \
+        .join(Order, Order.id == OrderItem.order_id).filter(Order.customer_id.isnot(None))
+    wishlists = db.session.query(Wishlist.customer_id, Wishlist.item_id)
+    carts = db.session.query(CartItem.customer_link, CartItem.item_id).filter(CartItem.item_id.isnot(None))
+    if since is not None:
+        orders = orders.filter(OrderItem.id > since.last_order_item_id)
+        wishlists = wishlists.filter(Wishlist.id > since.last_wishlist_id)
+        carts = carts.filter(CartItem.id > since.last_cart_item_id)
+    for name, q in (('order', orders), ('wishlist', wishlists), ('cart', carts)):
+        weight = WEIGHTS[name]
+        for customer_id, item_id in q.yield_per(10000):
+            yield customer_id, item_id, weight
+
+
+def _normalize_rows(np, sparse, m):
+    # unit-length rows, so a row product is a cosine similarity
+    norms = np.sqrt(np.asarray(m.multiply(m).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms) @ m
+
+
+def interaction_matrix(np, sparse, item_ids):
+    # items x customers, log-damped summed weights, rows normalised.
+    # also returns the customer -> column map for incremental builds
+    rows = list(_signals())
+    customers = {}
+    cols, items, weights = [], [], []
+    for customer_id, item_id, weight in rows:
+        cols.append(customers.setdefault(customer_id, len(customers)))
+        items.append(item_id)
+        weights.append(weight)
+    items = np.asarray(items, dtype=np.int64)
+    known = np.isin(items, item_ids)     # order lines can outlive their item
+    index = np.searchsorted(item_ids, items)
+    m = sparse.csr_matrix(
+        (np.asarray(weights)[known], (index[known], np.asarray(cols, dtype=np.int64)[known])),
+        shape=(len(item_ids), max(len(customers), 1)))
+    m.sum_duplicates()
+    m.data = np.log1p(m.data)
+    return _normalize_rows(np, sparse, m), customers
+
+
+def name_matrix(np, sparse, item_ids, names):
+    # items x name tokens, idf weighted, rows normalised. tokens found on a
+    # single item or on too many items are dropped
+    docs = [set(tokenize(name)) for name in names]
+    df = {}
+    for tokens in docs:
+        for t in tokens:
+            df[t] = df.get(t, 0) + 1
+    limit = max(2, MAX_TOKEN_SHARE * len(docs))
+    vocab = {}
+    for t, n in df.items():
+        if 2 <= n <= limit:
+            vocab[t] = len(vocab)
+    rows, cols, values = [], [], []
+    for i, tokens in enumerate(docs):
+        for t in tokens:
+            if t in vocab:
+                rows.append(i)
+                cols.append(vocab[t])
+                values.append(math.log(len(docs) / df[t]))
+    m = sparse.csr_matrix((values, (rows, cols)), shape=(len(item_ids), max(len(vocab), 1)))
+    return _normalize_rows(np, sparse, m)
+
+
+def top_neighbours(np, scores, block, item_ids, k):
+    # scores: csr block x items. yields (item_id, [(similar_id, score), ...])
+    # best first, ties broken by the lower item id
+    for i, row in enumerate(block):
+        start, end = scores.indptr[i], scores.indptr[i + 1]
+        cols = scores.indices[start:end]
+        values = scores.data[start:end]
+        keep = (cols != row) & (values > 0)
+        cols, values = cols[keep], values[keep]
+        if len(values) > k:
+            best = np.argpartition(-values, k - 1)[:k]
+            cols, values = cols[best], values[best]
+        order = np.lexsort((item_ids[cols], -values))
+        yield int(item_ids[row]), [(int(item_ids[c]), float(v))
+                                   for c, v in zip(cols[order], values[order])]
+
+
+# ---------------- BUILD ----------------
+def rows_to_update(np, item_ids, bought, customers, last):
+    # an incremental build rescores new items and every item of a customer
+    # with new activity: those are the rows whose co-occurrences changed.
+    # names of older items are rescored against new ones on the next --full
+    active = {customers[c] for c, item_id, weight in _signals(since=last) if c in customers}
+    touched = bought.tocsc()[:, sorted(active)].nonzero()[0] if active else []
+    return np.union1d(np.flatnonzero(item_ids > last.last_item_id), touched).astype(np.int64)
+
+
+def build(full=False, top_k=None, name_weight=None, progress=None):
+    # returns the RecommendBuild row written for this run
+    try:
+        import numpy as np
+        from scipy import sparse
+    except ImportError:
+        raise click.ClickException('building recommendations needs numpy and scipy '
+                                   '(pip install numpy scipy)')
+    config = current_app.config
+    top_k = top_k or config.get('RECOMMEND_TOP_K', TOP_K)
+    if name_weight is None:
+        name_weight = config.get('RECOMMEND_NAME_WEIGHT', NAME_WEIGHT)
+
+    last = None if full else RecommendBuild.query.order_by(RecommendBuild.id.desc()).first()
+    marks = _watermarks()
+    catalogue = db.session.query(Item.id, Item.name).order_by(Item.id).all()
+    item_ids = np.asarray([i for i, name in catalogue], dtype=np.int64)
+    bought, customers = interaction_matrix(np, sparse, item_ids)
+    names = name_matrix(np, sparse, item_ids, [name for i, name in catalogue])
+    bought_t, names_t = bought.T.tocsr(), names.T.tocsr()
+
+    if last is None:
+        rows = np.arange(len(item_ids))
+    else:
+        rows = rows_to_update(np, item_ids, bought, customers, last)
+
+    for start in range(0, len(rows), BLOCK):
+        block = rows[start:start + BLOCK]
+        scores = ((1 - name_weight) * (bought[block] @ bought_t)
+                  + name_weight * (names[block] @ names_t)).tocsr()
+        scores.sort_indices()
+        records = []
+        for item_id, neighbours in top_neighbours(np, scores, block, item_ids, top_k):
+            records.extend({'item_id': item_id, 'rank': rank, 'similar_id': similar_id, 'score': score}
+                           for rank, (similar_id, score) in enumerate(neighbours))
+        block_ids = item_ids[block].tolist()
+        SimilarItem.query.filter(SimilarItem.item_id.in_(block_ids)).delete(synchronize_session=False)
+        if records:
+            db.session.execute(insert(SimilarItem.__table__), records)
+        db.session.commit()
+        if progress:
+            progress(min(start + BLOCK, len(rows)), len(rows))
+
+    if last is None:
+        # items that no longer exist keep no neighbour lists
+        SimilarItem.query.filter(SimilarItem.item_id.notin_(
+            db.session.query(Item.id))).delete(synchronize_session=False)
+    run = RecommendBuild(full=last is None, items_updated=len(rows), **marks)
+    db.session.add(run)
+    db.session.commit()
+    catalog_cache.bump()
+    return run
+
+
+# ---------------- CLI ----------------
+recommend_cli = AppGroup('recommend', help='Precomputed "similar products".')
+
+
+@recommend_cli.command('build')
+@click.option('--full', is_flag=True, help='Rescore every item, not only those with new activity.')
+@click.option('--top-k', type=int, help='Neighbours kept per item (default RECOMMEND_TOP_K).')
+def build_command(full, top_k):
+    """Compute the similar-products table (incremental after the first run)."""
+    started = time.perf_counter()
+
+    def progress(done, total):
+        click.echo('\r%d / %d items' % (done, total), nl=False, err=True)
+
+    run = build(full=full, top_k=top_k, progress=progress)
+    click.echo('', err=True)
+    click.echo('%s build: %d items rescored in %.1fs' % (
+        'full' if run.full else 'incremental', run.items_updated, time.perf_counter() - started))
+
+
+@recommend_cli.command('show')
+@click.argument('item_id', type=int)
+def show_command(item_id):
+    """Print the stored neighbours of one item."""
+    rows = db.session.query(SimilarItem, Item.name) \
+        .join(Item, Item.id == SimilarItem.similar_id) \
+        .filter(SimilarItem.item_id == item_id).order_by(SimilarItem.rank).all()
+    for similar, name in rows:
+        click.echo('%2d  %6.3f  %6d  %s' % (similar.rank, similar.score, similar.similar_id, name))
+    if not rows:
+        click.echo('no neighbours stored for item %d' % item_id)
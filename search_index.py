@@ -0,0 +1,134 @@
+# search_index.py
+# full-text product search (SQLite FTS5 index over the item table)
+import re
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import text, and_
+from sqlalchemy.exc import OperationalError
+
+from db_create import db, Item
+
+PER_PAGE = 12
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# set by init_search() or on first search; False means we fall back to LIKE matching
+fts_enabled = None
+
+# ---------------- INDEX SETUP ----------------
+# external-content FTS5 table: only the tokens live here, rows stay in `item`.
+# triggers keep it in sync for every write (shop_items, seeding, imports ...)
+FTS_SETUP = [
+    """CREATE VIRTUAL TABLE item_fts USING fts5(
+        name,
+        content='item',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS item_fts_ai AFTER INSERT ON item BEGIN
+        INSERT INTO item_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS item_fts_ad AFTER DELETE ON item BEGIN
+        INSERT INTO item_fts(item_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS item_fts_au AFTER UPDATE OF name ON item BEGIN
+        INSERT INTO item_fts(item_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO item_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+]
+
+
+def init_search():
+    # create the index (first run only) and fill it from existing items
+    global fts_enabled
+    if db.engine.dialect.name != 'sqlite':
+        fts_enabled = False
+        return
+    try:
+        exists = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='item_fts'"
+        )).first()
+        if not exists:
+            for stmt in FTS_SETUP:
+                db.session.execute(text(stmt))
+            db.session.execute(text("INSERT INTO item_fts(item_fts) VALUES('rebuild')"))
+            db.session.commit()
+        fts_enabled = True
+    except OperationalError:
+        # sqlite build without fts5
+        db.session.rollback()
+        fts_enabled = False
+
+
+def fts_available():
+    # web workers don't run init_search(), they just look for the table once
+    global fts_enabled
+    if fts_enabled is None:
+        fts_enabled = db.engine.dialect.name == 'sqlite' and db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='item_fts'"
+        )).first() is not None
+    return fts_enabled
+
+
+def rebuild_index():
+    if fts_available():
+        db.session.execute(text("INSERT INTO item_fts(item_fts) VALUES('rebuild')"))
+        db.session.commit()
+
+
+# ---------------- QUERYING ----------------
+def tokenize(query):
+    return TOKEN_RE.findall((query or '').lower())
+
+
+def match_expression(tokens):
+    # every token must match, the last ones as prefixes ("smart w" -> smart* w*)
+    return ' '.join('"%s"*' % t for t in tokens)
+
+
+def search_items(query, page=1, per_page=PER_PAGE):
+    # returns (items, total) ranked best match first
+    page = max(int(page or 1), 1)
+    offset = (page - 1) * per_page
+    tokens = tokenize(query)
+
+    if not tokens:
+        q = Item.query.order_by(Item.date_added.desc(), Item.id.desc())
+        return q.offset(offset).limit(per_page).all(), q.count()
+
+    if not fts_available():
+        cond = and_(*[Item.name.ilike(f"%{t}%") for t in tokens])
+        q = Item.query.filter(cond).order_by(Item.name)
+        return q.offset(offset).limit(per_page).all(), q.count()
+
+    match = match_expression(tokens)
+    total = db.session.execute(
+        text("SELECT count(*) FROM item_fts WHERE item_fts MATCH :q"),
+        {'q': match}
+    ).scalar()
+    ids = [row[0] for row in db.session.execute(
+        text("SELECT rowid FROM item_fts WHERE item_fts MATCH :q "
+             "ORDER BY rank LIMIT :limit OFFSET :offset"),
+        {'q': match, 'limit': per_page, 'offset': offset}
+    )]
+    if not ids:
+        return [], total
+
+    # one IN (...) lookup, then restore the bm25 order
+    by_id = {i.id: i for i in Item.query.filter(Item.id.in_(ids)).all()}
+    return [by_id[i] for i in ids if i in by_id], total
+
+
+# ---------------- CLI ----------------
+search_cli = AppGroup('search', help='Full-text product search index.')
+
+
+@search_cli.command('rebuild')
+def rebuild_command():
+    """Rebuild the FTS index from the item table."""
+    if not fts_available():
+        click.echo('FTS5 not available; search uses LIKE matching')
+        return
+    rebuild_index()
+    click.echo('search index rebuilt')
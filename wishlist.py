@@ -0,0 +1,89 @@
+# wishlist.py
+# wishlist queries: one joined query per page, single-statement writes.
+# writes go through the group-commit queue (write_queue.py) unchanged, each
+# one statement (or delete-else-insert) whose result is the outcome
+from sqlalchemy.dialects.sqlite import insert
+
+from db_create import db, Item, Wishlist
+from write_queue import write_queue, MISSING
+
+PAGE_SIZE = 24
+
+
+def wishlist_page(customer_id, cursor=None, limit=PAGE_SIZE, sync=True):
+    # keyset pagination on wishlist.id (newest first)
+    # returns ([(wishlist_id, item), ...], next_cursor)
+    # sync=False: don't wait for this customer's queued changes
+    if sync:
+        write_queue.sync(customer_id)
+    q = db.session.query(Wishlist.id, Item) \
+        .join(Item, Item.id == Wishlist.item_id) \
+        .filter(Wishlist.customer_id == customer_id)
+    if cursor:
+        q = q.filter(Wishlist.id < cursor)
+    rows = q.order_by(Wishlist.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1][0]
+    return rows, next_cursor
+
+
+def is_saved(customer_id, item_id):
+    pending = write_queue.pending(customer_id, ('wishlist', item_id))
+    if pending is not MISSING:
+        return pending
+    return db.session.query(
+        Wishlist.query.filter_by(customer_id=customer_id, item_id=item_id).exists()
+    ).scalar()
+
+
+def _insert(customer_id, item_id):
+    # INSERT .. ON CONFLICT DO NOTHING on the (customer_id, item_id) index
+    stmt = insert(Wishlist).values(customer_id=customer_id, item_id=item_id) \
+        .on_conflict_do_nothing(index_elements=['customer_id', 'item_id'])
+    return db.session.execute(stmt).rowcount > 0
+
+
+def _delete(customer_id, item_id):
+    return Wishlist.query.filter_by(customer_id=customer_id, item_id=item_id) \
+        .delete(synchronize_session=False) > 0
+
+
+def _toggle(customer_id, item_id):
+    # delete if present, otherwise insert, in one transaction
+    if _delete(customer_id, item_id):
+        return 'removed'
+    _insert(customer_id, item_id)
+    return 'added'
+
+
+def _write(fn, customer_id, item_id, saved=None):
+    # the statement itself runs in the queue's transaction and decides the
+    # outcome; is_saved() answers `saved` (when known) until it commits
+    key = ('wishlist', item_id) if saved is not None else None
+    return write_queue.submit(fn, customer_id, item_id, customer_id=customer_id,
+                              key=key, value=saved, wait=True)
+
+
+def add(customer_id, item_id):
+    # returns True if a new row was written
+    return _write(_insert, customer_id, item_id, True)
+
+
+def remove(customer_id, item_id):
+    return _write(_delete, customer_id, item_id, False)
+
+
+def toggle(customer_id, item_id):
+    return _write(_toggle, customer_id, item_id)
+
+
+def item_to_json(item):
+    return {
+        'id': item.id,
+        'name': item.name,
+        'price': item.current_price,
+        'image': item.image,
+    }